@@ -1 +1,19 @@
-from .utils import TooManyDaysError, grab_mfp_data, show_metrics  # NOQA
+# utils pulls in pandas, httpx and the scraper so it's imported on first
+# use rather than with the package (PEP 562)
+_LAZY_ATTRS = {
+    "TooManyDaysError": ".utils",
+    "grab_mfp_data": ".utils",
+    "show_metrics": ".utils",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRS:
+        from importlib import import_module
+
+        return getattr(import_module(_LAZY_ATTRS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted([*globals(), *_LAZY_ATTRS])
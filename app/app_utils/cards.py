@@ -1,4 +1,5 @@
 import math
+from functools import lru_cache, wraps
 
 from PIL import Image, ImageDraw, ImageFont, ImageOps
 
@@ -8,21 +9,45 @@ CARD_HEIGHT = 667
 CARD_WIDTH = 375
 
 
-def create_base_card(
-    color,
-    font_path=FONT_PATH,
-    icon_path=ICON_PATH,
-    height=CARD_HEIGHT,
-    width=CARD_WIDTH,
-):
+@lru_cache(maxsize=None)
+def get_font(size: int, font_path=FONT_PATH) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(font_path, size)
+
+
+@lru_cache(maxsize=None)
+def load_image(path: str) -> Image.Image:
+    """load image once per process, copy it before changing it"""
+    with Image.open(path) as img:
+        img.load()
+        return img
+
+
+def card_template(render):
+    """render the static layer of a card once per process
+
+    The decorated function draws everything that doesn't depend on the
+    data, calling it returns (draw, card) for a copy of that layer.
+    """
+    cached_render = lru_cache(maxsize=None)(render)
+
+    @wraps(render)
+    def copy_template(*args):
+        card = cached_render(*args).copy()
+        return ImageDraw.Draw(card), card
+
+    copy_template.cache_clear = cached_render.cache_clear  # type:ignore
+    return copy_template
+
+
+@card_template
+def _base_card(color, font_path, icon_path, height, width):
     # create base card
     im = Image.new(mode="RGB", size=(width, height), color=color)
     draw = ImageDraw.Draw(im)
 
     # add mfp wrapped icon and text
-    icon_fnt = ImageFont.truetype(font_path, 16)
-    icon = Image.open(icon_path)
-    icon = icon.resize((30, 30))
+    icon_fnt = get_font(16, font_path)
+    icon = load_image(icon_path).resize((30, 30))
     im.paste(icon, (5, 5), icon)
     draw.text((40, 20), "mfp wrapped", font=icon_fnt, fill=(0, 0, 0))
 
@@ -33,14 +58,37 @@ def create_base_card(
         font=icon_fnt,
         fill=(0, 0, 0),
     )
-    return (draw, im)
+    return im
 
 
-def generate_total_kcal_card(num_kcal: int):
+def create_base_card(
+    color,
+    font_path=FONT_PATH,
+    icon_path=ICON_PATH,
+    height=CARD_HEIGHT,
+    width=CARD_WIDTH,
+):
+    return _base_card(tuple(color), font_path, icon_path, height, width)
+
+
+@card_template
+def _total_kcal_template():
     draw, card = create_base_card((148, 240, 180))
+    _, card_height = card.size
+    draw.text(
+        (200, (card_height / 2) - 100),
+        "Total calories",
+        font=get_font(20),
+        fill=(110, 110, 110),
+    )
+    return card
+
+
+def generate_total_kcal_card(num_kcal: int):
+    draw, card = _total_kcal_template()
     card_width, card_height = card.size
     font_size = 90
-    title_fnt = ImageFont.truetype(FONT_PATH, font_size)
+    title_fnt = get_font(font_size)
     _, _, num_kcal_w, _ = draw.textbbox(
         (0, 0), f"{num_kcal:,}", font=title_fnt
     )
@@ -48,7 +96,7 @@ def generate_total_kcal_card(num_kcal: int):
     # shirnk font size for large total_kcal displays
     while num_kcal_w > card_width - 20:
         font_size -= 3
-        title_fnt = ImageFont.truetype(FONT_PATH, font_size)
+        title_fnt = get_font(font_size)
         _, _, num_kcal_w, _ = draw.textbbox(
             (0, 0), f"{num_kcal:,}", font=title_fnt
         )
@@ -61,18 +109,11 @@ def generate_total_kcal_card(num_kcal: int):
     )
 
     # compare with household power consumption
-    kcal_fnt = ImageFont.truetype(FONT_PATH, 20)
-    fnt = ImageFont.truetype(FONT_PATH, 36)
+    fnt = get_font(36)
     #  https://shrinkthatfootprint.com/average-household-electricity-consumption/
     # average household usage = 29kwH = 25000 kcal
     household_daily_usage_kcal = 25_000
     num_homes = num_kcal / household_daily_usage_kcal
-    draw.text(
-        (200, (card_height / 2) - 100),
-        "Total calories",
-        font=kcal_fnt,
-        fill=(110, 110, 110),
-    )
 
     draw.text(
         (20, (card_height / 2) - 75),
@@ -81,7 +122,7 @@ def generate_total_kcal_card(num_kcal: int):
     )
 
     # add home icons
-    home_img = Image.open("../app/images/home.png")
+    home_img = load_image("../app/images/home.png").copy()
     home_imgs_top = 380
     num_cols = 4
     num_rows = math.ceil(num_homes / num_cols)
@@ -132,18 +173,25 @@ def generate_total_kcal_card(num_kcal: int):
     return card
 
 
-def generate_top_foods_card(top_entries: dict[str, int]):
+@card_template
+def _top_foods_template():
+    draw, card = create_base_card((250, 250, 250))
+    draw.text(
+        (12, 60),
+        "Your top 5 food entries",
+        fill=(0, 102, 238),
+        font=get_font(30),
+    )
+    return card
 
-    draw, top5_card = create_base_card((250, 250, 250))
 
-    head_fnt = ImageFont.truetype(FONT_PATH, 30)
-    num_fnt = ImageFont.truetype(FONT_PATH, 42)
-    food_fnt = ImageFont.truetype(FONT_PATH, 30)
-    qty_fnt = ImageFont.truetype(FONT_PATH, 18)
+def generate_top_foods_card(top_entries: dict[str, int]):
 
-    draw.text(
-        (12, 60), "Your top 5 food entries", fill=(0, 102, 238), font=head_fnt
-    )
+    draw, top5_card = _top_foods_template()
+
+    num_fnt = get_font(42)
+    food_fnt = get_font(30)
+    qty_fnt = get_font(18)
 
     for rank, (food, qty) in enumerate(top_entries.items()):
         rank += 1
@@ -166,19 +214,67 @@ def generate_top_foods_card(top_entries: dict[str, int]):
     return top5_card
 
 
+@card_template
+def _top_sources_template():
+    draw, card = create_base_card((255, 200, 87))
+    draw.text((12, 60), "Your top sources", fill=(0, 0, 0), font=get_font(30))
+    return card
+
+
+def generate_top_sources_card(top_sources: dict[str, tuple[str, int]]):
+    """card of the food that contributed most of each nutrient
+
+    Args:
+        top_sources (dict[str, tuple[str, int]]): nutrient column (e.g.
+        "protein_g") mapped to (food, total amount)
+    """
+    draw, top_sources_card = _top_sources_template()
+
+    label_fnt = get_font(20)
+    food_fnt = get_font(30)
+    amount_fnt = get_font(18)
+
+    for rank, (nutrient, (food, amount)) in enumerate(top_sources.items()):
+        name, _, unit = nutrient.rpartition("_")
+        if len(food) > 18:
+            food = food[:15] + "..."
+        top = (rank * 120) + 120
+        draw.text(
+            (20, top), name.capitalize(), fill=(110, 110, 110), font=label_fnt
+        )
+        draw.text((20, top + 25), food, fill=(0, 0, 0), font=food_fnt)
+        draw.text(
+            (20, top + 60),
+            f"{amount:,} {unit}",
+            fill=(0, 84, 143),
+            font=amount_fnt,
+        )
+
+    return top_sources_card
+
+
+@card_template
+def _days_tracked_template():
+    draw, card = create_base_card((184, 89, 192))
+    streak_font = get_font(20)
+    draw.text((30, 420), "Longest Streak", font=streak_font, fill=(0, 0, 0))
+    draw.text((30, 500), "Longest Blank", font=streak_font, fill=(0, 0, 0))
+    return card
+
+
 def generate_days_tracked_card(
     tracked_days, total_days, longest_streak, longest_blank
 ):
-    draw, days_tracked_card = create_base_card((184, 89, 192))
+    draw, days_tracked_card = _days_tracked_template()
 
     perc_days = tracked_days / total_days
 
-    perc_font = ImageFont.truetype(FONT_PATH, 140)
+    perc_font = get_font(140)
     draw.text(
         (0, 120), f"{perc_days*100:.0f}%", font=perc_font, fill=(0, 0, 0, 200)
     )
 
-    font = ImageFont.truetype(FONT_PATH, 40)
+    font = get_font(40)
     draw.text(
         (10, 220),
         f"You entered food\n\tin your diary on\n\t\t{tracked_days} days\n\t\t"
@@ -186,49 +282,37 @@ def generate_days_tracked_card(
         font=font,
     )
 
-    streak_font = ImageFont.truetype(FONT_PATH, 20)
-    draw.text((30, 420), "Longest Streak", font=streak_font, fill=(0, 0, 0))
+    streak_font = get_font(20)
     draw.text((30, 445), f"{longest_streak} days", font=streak_font)
-
-    draw.text((30, 500), "Longest Blank", font=streak_font, fill=(0, 0, 0))
     draw.text((30, 525), f"{longest_blank} days", font=streak_font)
 
     return days_tracked_card
 
 
-def generate_adherence_card(adherence: float, tolerance: float = 0.1):
-    draw, adherence_card = create_base_card((0, 102, 238))
-    card_w, card_h = adherence_card.size
-
-    phrase_imgs = (
-        ("None of my business though", "../app/images/kermit.jpg"),
-        (
-            "Sometimes Maybe Good,\nSometimes Maybe Shit",
-            "../app/images/gattuso.png",
-        ),
-        ("Mr Consistent", "../app/images/checklist.jpg"),
-    )
+ADHERENCE_PHRASE_IMGS = (
+    ("None of my business though", "../app/images/kermit.jpg"),
+    (
+        "Sometimes Maybe Good,\nSometimes Maybe Shit",
+        "../app/images/gattuso.png",
+    ),
+    ("Mr Consistent", "../app/images/checklist.jpg"),
+)
 
-    def get_adherence_level(adherence_perc: float):
-        if adherence_perc < 0.3:
-            return 0
-        if adherence_perc > 0.7:
-            return 2
-        return 1
 
-    threshold_lvl = get_adherence_level(adherence)
-    phrase_font = ImageFont.truetype(FONT_PATH, 18)
+@card_template
+def _adherence_template(threshold_lvl: int):
+    draw, card = create_base_card((0, 102, 238))
+    card_w, card_h = card.size
+    phrase_font = get_font(18)
 
-    meme_img = Image.open(phrase_imgs[threshold_lvl][1])
+    meme_img = load_image(ADHERENCE_PHRASE_IMGS[threshold_lvl][1]).copy()
     meme_img.thumbnail((180, 180))
     meme_img_border = ImageOps.expand(meme_img, border=5, fill=(0, 0, 0))
     meme_w, meme_h = meme_img_border.size
     img_top = 90
-    adherence_card.paste(
-        meme_img_border, (int((card_w - meme_w) / 2), img_top)
-    )
+    card.paste(meme_img_border, (int((card_w - meme_w) / 2), img_top))
 
-    phrase = phrase_imgs[threshold_lvl][0]
+    phrase = ADHERENCE_PHRASE_IMGS[threshold_lvl][0]
     _, _, w, _ = draw.textbbox((0, 0), phrase, font=phrase_font)
     draw.text(
         ((card_w - w) / 2, img_top + meme_h + 10),
@@ -236,15 +320,27 @@ def generate_adherence_card(adherence: float, tolerance: float = 0.1):
         font=phrase_font,
         align="center",
     )
+    return card
+
+
+def generate_adherence_card(adherence: float, tolerance: float = 0.1):
+    def get_adherence_level(adherence_perc: float):
+        if adherence_perc < 0.3:
+            return 0
+        if adherence_perc > 0.7:
+            return 2
+        return 1
+
+    draw, adherence_card = _adherence_template(get_adherence_level(adherence))
 
-    adherence_font = ImageFont.truetype(FONT_PATH, 42)
+    adherence_font = get_font(42)
     draw.text(
         (20, 350),
         f"You met your\nnutrition goals\n{adherence*100:.0f}% of the time*",
         font=adherence_font,
     )
 
-    disclaimer_font = ImageFont.truetype(FONT_PATH, 15)
+    disclaimer_font = get_font(15)
     draw.text(
         (20, 550),
         f"*within {tolerance*100:.0f}% of kcal goal",
@@ -6,6 +6,7 @@ from typing import Dict, Tuple
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+from myfitnesspal.analysis import get_top_sources
 
 
 def plot_most_common(most_common: pd.Series):
@@ -152,43 +153,147 @@ def plot_intake_goals(
     return fig
 
 
-def most_common_macros(diary_df: pd.DataFrame) -> Dict[str, Tuple]:
+def plot_adherence_curves(
+    curves_df: pd.DataFrame, macro: str = "all", tolerance: float = 0.1
+):
     """
-    return most common source for each macro type
+    Plot how often goals were met as the tolerance either side of the goal
+    grows, curves_df is AdherenceCurves.to_frame() output.
+    For 'all' plot a line per macro, otherwise split days for that macro
+    into under/within/over goal.
     """
-    food_totals_df = diary_df.groupby("food").sum()[
-        [
-            "calories_kcal",
-            "carbs_g",
-            "fat_g",
-            "protein_g",
-            "sugar_g",
-            "fiber_g",
-        ]
-    ]
+    macro_colours = {
+        "carbs": "darkturquoise",
+        "fat": "tomato",
+        "protein": "mediumorchid",
+        "calories": "darkorange",
+    }
+    curves_df = curves_df.assign(
+        tolerance=curves_df["tolerance"] * 100,
+        within=curves_df["within"] * 100,
+        over=curves_df["over"] * 100,
+        under=curves_df["under"] * 100,
+    )
+    fig = go.Figure()
 
-    top_cal_source = food_totals_df.sort_values(
-        "calories_kcal", ascending=False
-    ).iloc[0]
-    top_carb_source = food_totals_df.sort_values(
-        "carbs_g", ascending=False
-    ).iloc[0]
-    top_fat_source = food_totals_df.sort_values("fat_g", ascending=False).iloc[
-        0
-    ]
-    top_protein_source = food_totals_df.sort_values(
-        "protein_g", ascending=False
-    ).iloc[0]
+    if macro == "all":
+        for macro_name, macro_df in curves_df.groupby("macro", sort=False):
+            fig.add_trace(
+                go.Scatter(
+                    x=macro_df["tolerance"],
+                    y=macro_df["within"],
+                    mode="lines",
+                    name=macro_name,
+                    line={"color": macro_colours[macro_name]},
+                )
+            )
+        yaxis_title = "% of days within goal"
+    else:
+        macro_df = curves_df[curves_df["macro"] == macro]
+        for col, color in [
+            ("under", "lightgrey"),
+            ("within", macro_colours[macro]),
+            ("over", "dimgrey"),
+        ]:
+            fig.add_trace(
+                go.Scatter(
+                    x=macro_df["tolerance"],
+                    y=macro_df[col],
+                    mode="lines",
+                    name=col,
+                    stackgroup="days",
+                    line={"color": color},
+                )
+            )
+        yaxis_title = "% of days"
+
+    fig.add_vline(
+        x=tolerance * 100,
+        line={"dash": "dash", "color": "black"},
+        annotation_text="card tolerance",
+    )
+    fig.update_layout(
+        title="Goal Adherence vs Tolerance",
+        xaxis_title="Tolerance (% of goal)",
+        yaxis_title=yaxis_title,
+    )
+    return fig
+
+
+def plot_rolling_averages(
+    daily_data: pd.DataFrame, rolling_df: pd.DataFrame, column: str
+):
+    """
+    Plot daily intake with a line per rolling window, rolling_df is
+    get_rolling_averages output.
+    """
+    fig = go.Figure()
+    fig.add_trace(
+        go.Bar(
+            x=daily_data.index,
+            y=daily_data[column],
+            name="daily",
+            marker_color="lightgrey",
+        )
+    )
+    for window in rolling_df.columns.get_level_values(0).unique():
+        fig.add_trace(
+            go.Scatter(
+                x=rolling_df.index,
+                y=rolling_df[(window, column)],
+                mode="lines",
+                name=f"{window.lower()} average",
+            )
+        )
+    fig.update_layout(
+        title="Rolling Average Intake",
+        xaxis_title="Date",
+        yaxis_title=column,
+    )
+    return fig
+
+
+def plot_weekday_profile(weekday_df: pd.DataFrame, column: str):
+    """
+    Plot average intake per day of the week, weekday_df is
+    get_weekday_profile output.
+    """
+    fig = px.bar(
+        weekday_df,
+        y=column,
+        title="Average Intake by Day of the Week",
+        hover_data=["days"],
+        labels={"weekday": "", column: column, "days": "days tracked"},
+    )
+    return fig
+
+
+def plot_meal_intake(meal_intake: pd.DataFrame):
+    """
+    Plot stacked bar chart of daily calories by meal, meal_intake is
+    get_meal_intake output.
+    """
+    fig = px.bar(
+        meal_intake,
+        title="Calories by Meal",
+        labels={"date": "Date", "value": "kcal", "meal": "meal"},
+    )
+    return fig
+
+
+def most_common_macros(diary_df: pd.DataFrame) -> Dict[str, Tuple]:
+    """
+    return most common source for each macro type the diary tracks
+    """
+    macro_cols = {
+        "calories_kcal": "calories",
+        "carbs_g": "carbs",
+        "fat_g": "fats",
+        "protein_g": "proteins",
+    }
+    top_sources = get_top_sources(diary_df, nutrients=macro_cols)
 
     return {
-        "calories": (
-            top_cal_source.name,
-            int(top_cal_source["calories_kcal"]),
-        ),
-        "carbs": (top_carb_source.name, int(top_carb_source["carbs_g"])),
-        "fats": (top_fat_source.name, int(top_fat_source["fat_g"])),
-        "proteins": (
-            top_protein_source.name,
-            int(top_protein_source["protein_g"]),
-        ),
+        macro_cols[source.nutrient]: (source.food, int(source.amount))
+        for source in top_sources.itertuples()
     }
@@ -0,0 +1,214 @@
+"""
+Opt-in cProfile and tracemalloc profiling of a full report run.
+
+Enable for every run with MFP_PROFILE=1 or for a random fraction of runs
+with e.g. MFP_PROFILE_SAMPLE_RATE=0.01. Single runs can be profiled with
+?profile=1 in the url if the operator allows it with
+MFP_PROFILE_ALLOW_QUERY=1, otherwise any visitor could turn profiling on.
+Reports are written to MFP_PROFILE_DIR (default "profiles"), keeping the
+latest MFP_PROFILE_MAX_REPORTS (default 50).
+
+Besides the session's own thread the report covers the work the run hands
+to worker threads (parsing and archiving diary pages) and the shared scrape
+loop thread. The loop is shared by every session, so while a run is
+profiled its report also includes other sessions' fetches.
+"""
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import random
+import re
+import threading
+import tracemalloc
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional
+
+from myfitnesspal.instrumentation import collect_thread_profiles
+
+TRACEMALLOC_FRAMES = 10
+TOP_N = 30
+MAX_REPORTS = 50
+
+# tracemalloc is process wide so only profile one run at a time
+_profile_lock = threading.Lock()
+
+
+@dataclass
+class ProfileReport:
+    """paths of the written report, set once the profiled block exits"""
+
+    report_path: Optional[str] = None
+    stats_path: Optional[str] = None
+
+
+def _is_truthy(value: Optional[str]) -> bool:
+    return value not in (None, "", "0", "false")
+
+
+def should_profile(query_params: Dict[str, List[str]]) -> bool:
+    """decide whether to profile this run from env vars and url params"""
+    allow_query = _is_truthy(os.environ.get("MFP_PROFILE_ALLOW_QUERY"))
+    if allow_query and _is_truthy(query_params.get("profile", [""])[0]):
+        return True
+    if _is_truthy(os.environ.get("MFP_PROFILE")):
+        return True
+    sample_rate = float(os.environ.get("MFP_PROFILE_SAMPLE_RATE", 0))
+    return sample_rate > 0 and random.random() < sample_rate
+
+
+def _remove_old_reports(out_dir: str, keep: int) -> None:
+    """keep the latest reports, each is a .prof and a .txt file"""
+    # file names start with a timestamp so they sort oldest first
+    runs = sorted(
+        {
+            os.path.splitext(name)[0]
+            for name in os.listdir(out_dir)
+            if name.endswith((".prof", ".txt"))
+        }
+    )
+    for run in runs[: max(len(runs) - keep, 0)]:
+        for extension in (".prof", ".txt"):
+            try:
+                os.remove(os.path.join(out_dir, run + extension))
+            except FileNotFoundError:
+                pass
+
+
+def _call_in_loop(loop: asyncio.AbstractEventLoop, fn: Callable[[], None]):
+    """run fn on the loop's thread and wait for it"""
+    done: Future = Future()
+
+    def run() -> None:
+        try:
+            fn()
+        except BaseException as error:
+            done.set_exception(error)
+        else:
+            done.set_result(None)
+
+    loop.call_soon_threadsafe(run)
+    done.result()
+
+
+@contextmanager
+def _profile_loop_thread(
+    profiles: List[cProfile.Profile],
+) -> Iterator[None]:
+    """profile the scrape loop's thread, cProfile only sees the thread
+    it's enabled in"""
+    from myfitnesspal.scheduler import get_scheduler
+
+    loop = get_scheduler().loop
+    profiler = cProfile.Profile()
+    _call_in_loop(loop, profiler.enable)
+    try:
+        yield
+    finally:
+        _call_in_loop(loop, profiler.disable)
+        profiles.append(profiler)
+
+
+def _write_report(
+    path: str,
+    label: str,
+    stats: pstats.Stats,
+    start_snapshot: tracemalloc.Snapshot,
+    end_snapshot: tracemalloc.Snapshot,
+    peak_bytes: int,
+    top_n: int,
+) -> None:
+    stats_stream = io.StringIO()
+    stats.stream = stats_stream  # type: ignore
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top_n)
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(top_n)
+
+    allocations = end_snapshot.compare_to(start_snapshot, "lineno")[:top_n]
+
+    with open(path, "w") as report_file:
+        report_file.write(f"profile of {label}\n")
+        report_file.write(f"peak traced memory: {peak_bytes / 1e6:.1f} MB\n")
+        report_file.write("\n=== top functions ===\n")
+        report_file.write(stats_stream.getvalue())
+        report_file.write("\n=== top allocation sites (net of run) ===\n")
+        for allocation in allocations:
+            report_file.write(f"{allocation}\n")
+
+
+@contextmanager
+def profile_run(
+    label: str,
+    enabled: bool = True,
+    out_dir: Optional[str] = None,
+    top_n: int = TOP_N,
+) -> Iterator[ProfileReport]:
+    """profile the block with cProfile and tracemalloc and write a report
+
+    Profiling is skipped if it's disabled or another run is already being
+    profiled in this process.
+
+    Args:
+        label (str): name for the run, e.g. username, used in file names
+        enabled (bool): profile the block, pass should_profile(...)
+        out_dir (Optional[str]): directory to write reports to
+        top_n (int): number of functions/allocation sites to report
+
+    Yields:
+        ProfileReport: paths of the report, set after the block exits
+    """
+    report = ProfileReport()
+    if not enabled or not _profile_lock.acquire(blocking=False):
+        yield report
+        return
+
+    started_tracing = not tracemalloc.is_tracing()
+    try:
+        if started_tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        tracemalloc.reset_peak()
+        start_snapshot = tracemalloc.take_snapshot()
+        profiler = cProfile.Profile()
+        profiles: List[cProfile.Profile] = []
+        profiler.enable()
+        try:
+            with collect_thread_profiles() as thread_profiles:
+                with _profile_loop_thread(profiles):
+                    yield report
+        finally:
+            profiler.disable()
+            stats = pstats.Stats(profiler)
+            for other in profiles + thread_profiles:
+                stats.add(other)
+            _, peak_bytes = tracemalloc.get_traced_memory()
+            end_snapshot = tracemalloc.take_snapshot()
+
+            out_dir = out_dir or os.environ.get("MFP_PROFILE_DIR", "profiles")
+            os.makedirs(out_dir, exist_ok=True)
+            timestamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+            file_label = re.sub(r"[^\w-]", "_", label)
+            base_path = os.path.join(out_dir, f"{timestamp}-{file_label}")
+
+            stats.dump_stats(f"{base_path}.prof")
+            _write_report(
+                f"{base_path}.txt",
+                label,
+                stats,
+                start_snapshot,
+                end_snapshot,
+                peak_bytes,
+                top_n,
+            )
+            report.report_path = f"{base_path}.txt"
+            report.stats_path = f"{base_path}.prof"
+            _remove_old_reports(
+                out_dir,
+                int(os.environ.get("MFP_PROFILE_MAX_REPORTS", MAX_REPORTS)),
+            )
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+        _profile_lock.release()
@@ -0,0 +1,146 @@
+"""
+Wrapped report metrics and cards, independent of the streamlit page
+"""
+from typing import Any, Dict
+
+import pandas as pd
+from myfitnesspal.analysis import DiarySummary, get_top_sources
+from PIL import Image
+
+from .cards import (
+    generate_adherence_card,
+    generate_days_tracked_card,
+    generate_top_foods_card,
+    generate_top_sources_card,
+    generate_total_kcal_card,
+)
+
+ADHERENCE_TOLERANCE = 0.1
+# nutrients shown on the top sources card
+TOP_SOURCE_NUTRIENTS = ["calories_kcal", "carbs_g", "fat_g", "protein_g"]
+
+
+def get_wrapped_metrics(
+    summary: DiarySummary, tolerance: float = ADHERENCE_TOLERANCE
+) -> Dict[str, Any]:
+    """calculate all metrics shown on the wrapped cards
+
+    Args:
+        summary (DiarySummary): summary of the analysed range
+        tolerance (float): tolerance of kcal goal used for adherence
+
+    Returns:
+        Dict[str, Any]: json serialisable metrics
+    """
+    most_common_foods = summary.most_common()
+    longest_streak, longest_blank = summary.longest_streaks()
+
+    return {
+        "start_date": summary.start_date.isoformat(),
+        "end_date": summary.end_date.isoformat(),
+        "total_days": summary.total_days,
+        "days_tracked": summary.logged_days,
+        "longest_streak": int(longest_streak),
+        "longest_blank": int(longest_blank),
+        "adherence": float(summary.adherence(tolerance)),
+        "tolerance": tolerance,
+        "totals": summary.total_macros(),
+        "top_foods": {
+            food: int(count) for food, count in most_common_foods.items()
+        },
+    }
+
+
+def get_top_sources_metrics(diary_df: pd.DataFrame) -> Dict[str, Any]:
+    """top food for each nutrient on the top sources card
+
+    Returns:
+        Dict[str, Any]: nutrient mapped to [food, total amount]
+    """
+    top_sources = get_top_sources(diary_df, nutrients=TOP_SOURCE_NUTRIENTS)
+    return {
+        source.nutrient: [source.food, int(source.amount)]
+        for source in top_sources.itertuples()
+    }
+
+
+def get_estimated_metrics(
+    sample_summary: DiarySummary,
+    num_sampled_days: int,
+    tolerance: float = ADHERENCE_TOLERANCE,
+) -> Dict[str, Any]:
+    """estimate wrapped metrics for the whole range from sampled days
+
+    Counts and totals are scaled up by the sampling rate and adherence is
+    taken from the sampled days as is. Streaks can't be estimated from a
+    sample, so longest_streak and longest_blank are None.
+
+    Args:
+        sample_summary (DiarySummary): summary of the full range built from
+        the sampled days only
+        num_sampled_days (int): number of days that were sampled
+        tolerance (float): tolerance of kcal goal used for adherence
+
+    Returns:
+        Dict[str, Any]: metrics in the same form as get_wrapped_metrics
+    """
+    total_days = sample_summary.total_days
+    scale = total_days / num_sampled_days
+
+    return {
+        "start_date": sample_summary.start_date.isoformat(),
+        "end_date": sample_summary.end_date.isoformat(),
+        "total_days": total_days,
+        "days_tracked": min(
+            round(sample_summary.logged_days * scale), total_days
+        ),
+        "longest_streak": None,
+        "longest_blank": None,
+        "adherence": float(sample_summary.adherence(tolerance)),
+        "tolerance": tolerance,
+        "totals": {
+            label: round(total * scale)
+            for label, total in sample_summary.total_macros().items()
+        },
+        "top_foods": {
+            food: round(count * scale)
+            for food, count in sample_summary.most_common().items()
+        },
+        "estimate": True,
+        "sampled_days": num_sampled_days,
+    }
+
+
+def generate_wrapped_cards(metrics: Dict[str, Any]) -> Dict[str, Image.Image]:
+    """render every wrapped card from get_wrapped_metrics output
+
+    The days tracked card is left out for estimated metrics as it needs
+    streaks and the top sources card is only added if metrics has
+    "top_sources" from get_top_sources_metrics.
+    """
+    cards = {
+        "total_kcal": generate_total_kcal_card(
+            metrics["totals"]["Calories (kcal)"]
+        ),
+        "top_foods": generate_top_foods_card(
+            dict(list(metrics["top_foods"].items())[:5])
+        ),
+        "adherence": generate_adherence_card(
+            metrics["adherence"], tolerance=metrics["tolerance"]
+        ),
+    }
+    if metrics.get("top_sources"):
+        cards["top_sources"] = generate_top_sources_card(
+            {
+                nutrient: tuple(source)
+                for nutrient, source in metrics["top_sources"].items()
+            }
+        )
+    if metrics["longest_streak"] is not None:
+        cards["days_tracked"] = generate_days_tracked_card(
+            metrics["days_tracked"],
+            metrics["total_days"],
+            metrics["longest_streak"],
+            metrics["longest_blank"],
+        )
+    return cards
@@ -0,0 +1,374 @@
+"""
+Animated wrapped story built from the wrapped cards
+
+The story counts up the calorie total, fills in a timeline of tracked days,
+reveals the top foods one by one and then shows the remaining cards. Each
+frame is described by a small hashable spec so that:
+
+- consecutive identical frames are merged into one longer frame
+- each distinct frame is rendered once, in a process pool
+- workers keep the static layer of each card (see cards.card_template),
+  so a frame only draws its data on a copy of it
+
+Frames are encoded once at the end to GIF or WebP, or to MP4 if ffmpeg is
+on the PATH.
+"""
+import io
+import math
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import date
+from functools import lru_cache
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import pandas as pd
+from myfitnesspal.analysis import DiarySummary
+from PIL import Image
+
+from .cards import (
+    card_template,
+    create_base_card,
+    generate_adherence_card,
+    generate_days_tracked_card,
+    generate_top_foods_card,
+    generate_top_sources_card,
+    generate_total_kcal_card,
+    get_font,
+)
+
+STORY_FORMATS = ("gif", "webp", "mp4")
+# every duration is a multiple of this so mp4 can use a fixed frame rate
+FRAME_MS = 40
+COUNT_UP_FRAMES = 30
+TIMELINE_FRAMES = 30
+REVEAL_MS = 600
+HOLD_MS = 1600
+
+TIMELINE_COLOR = (184, 89, 192)
+TRACKED_COLOR = (255, 255, 255)
+BLANK_COLOR = (120, 50, 128)
+
+# (renderer name, *args) - must be hashable and cheap to pickle
+FrameSpec = Tuple[Hashable, ...]
+
+
+def get_tracked_timeline(summary: DiarySummary) -> str:
+    """days of the summary as a string of 1 (tracked) and 0 (blank)"""
+    days = pd.date_range(summary.start_date, summary.end_date)
+    return "".join(
+        "1" if tracked else "0" for tracked in days.isin(summary.daily.index)
+    )
+
+
+def _ease_out(progress: float) -> float:
+    return 1 - (1 - progress) ** 3
+
+
+def _count_up_frames(
+    total_kcal: int, num_frames: int = COUNT_UP_FRAMES
+) -> List[Tuple[FrameSpec, int]]:
+    frames = [
+        (
+            ("total_kcal", round(total_kcal * _ease_out(idx / num_frames))),
+            FRAME_MS,
+        )
+        for idx in range(1, num_frames)
+    ]
+    frames.append((("total_kcal", total_kcal), HOLD_MS))
+    return frames
+
+
+def _timeline_frames(
+    timeline: str, start_date: date, num_frames: int = TIMELINE_FRAMES
+) -> List[Tuple[FrameSpec, int]]:
+    num_days = len(timeline)
+    start = start_date.isoformat()
+    frames = [
+        (
+            (
+                "timeline",
+                timeline,
+                start,
+                math.ceil(num_days * _ease_out(idx / num_frames)),
+            ),
+            FRAME_MS,
+        )
+        for idx in range(1, num_frames)
+    ]
+    frames.append((("timeline", timeline, start, num_days), HOLD_MS))
+    return frames
+
+
+def _top_foods_frames(
+    top_foods: Dict[str, int]
+) -> List[Tuple[FrameSpec, int]]:
+    entries = tuple(list(top_foods.items())[:5])
+    frames = [
+        (("top_foods", entries[:num_shown]), REVEAL_MS)
+        for num_shown in range(1, len(entries))
+    ]
+    frames.append((("top_foods", entries), HOLD_MS))
+    return frames
+
+
+def build_story_frames(
+    metrics: Dict[str, Any], timeline: Optional[str] = None
+) -> List[Tuple[FrameSpec, int]]:
+    """frame specs and durations (ms) of the story for wrapped metrics
+
+    Args:
+        metrics (Dict[str, Any]): report.get_wrapped_metrics output
+        timeline (Optional[str]): get_tracked_timeline output, the timeline
+        scene is skipped if it's missing
+
+    Returns:
+        List[Tuple[FrameSpec, int]]: consecutive frames are never equal
+    """
+    frames = _count_up_frames(metrics["totals"]["Calories (kcal)"])
+    if timeline:
+        frames += _timeline_frames(
+            timeline, date.fromisoformat(metrics["start_date"])
+        )
+    if metrics["top_foods"]:
+        frames += _top_foods_frames(metrics["top_foods"])
+    if metrics.get("top_sources"):
+        sources = tuple(
+            (nutrient, tuple(source))
+            for nutrient, source in metrics["top_sources"].items()
+        )
+        frames.append((("top_sources", sources), HOLD_MS))
+    if metrics["longest_streak"] is not None:
+        frames.append(
+            (
+                (
+                    "days_tracked",
+                    metrics["days_tracked"],
+                    metrics["total_days"],
+                    metrics["longest_streak"],
+                    metrics["longest_blank"],
+                ),
+                HOLD_MS,
+            )
+        )
+    frames.append(
+        (("adherence", metrics["adherence"], metrics["tolerance"]), HOLD_MS)
+    )
+
+    # counting up small totals repeats numbers, show them once for longer
+    merged: List[Tuple[FrameSpec, int]] = []
+    for spec, duration in frames:
+        if merged and merged[-1][0] == spec:
+            merged[-1] = (spec, merged[-1][1] + duration)
+        else:
+            merged.append((spec, duration))
+    return merged
+
+
+def _timeline_grid(num_days: int, width: int, height: int) -> Tuple[int, int]:
+    """(columns, cell size) of the largest square cells that fit"""
+    best_cols, best_cell = 1, 0
+    for cols in range(1, num_days + 1):
+        cell = min(width // cols, height // math.ceil(num_days / cols))
+        if cell > best_cell:
+            best_cols, best_cell = cols, cell
+    return best_cols, best_cell
+
+
+@card_template
+def _timeline_template():
+    draw, card = create_base_card(TIMELINE_COLOR)
+    draw.text((12, 60), "Your year in food", fill=(0, 0, 0), font=get_font(30))
+    return card
+
+
+def generate_timeline_card(timeline: str, start_date: str, num_shown: int):
+    """card of tracked and blank days with the first num_shown filled in"""
+    draw, card = _timeline_template()
+    card_w, _ = card.size
+
+    grid_top, grid_left = 120, 20
+    grid_w, grid_h = card_w - 2 * grid_left, 360
+    cols, cell = _timeline_grid(len(timeline), grid_w, grid_h)
+    pad = 1 if cell < 8 else 2
+    for idx, tracked in enumerate(timeline[:num_shown]):
+        row, col = divmod(idx, cols)
+        left = grid_left + col * cell
+        top = grid_top + row * cell
+        draw.rectangle(
+            (left, top, left + cell - pad - 1, top + cell - pad - 1),
+            fill=TRACKED_COLOR if tracked == "1" else BLANK_COLOR,
+        )
+
+    shown = timeline[:num_shown]
+    last_shown = pd.Timestamp(start_date) + pd.Timedelta(days=num_shown - 1)
+    draw.text(
+        (20, 500),
+        f"{shown.count('1')} days tracked",
+        font=get_font(36),
+        fill=(0, 0, 0),
+    )
+    draw.text(
+        (20, 545),
+        f"up to {last_shown:%d %b %Y}",
+        font=get_font(20),
+        fill=(0, 0, 0),
+    )
+    return card
+
+
+def _render(spec: FrameSpec) -> Image.Image:
+    name, *args = spec
+    if name == "total_kcal":
+        return generate_total_kcal_card(*args)
+    if name == "timeline":
+        return generate_timeline_card(*args)
+    if name == "top_foods":
+        return generate_top_foods_card(dict(args[0]))
+    if name == "top_sources":
+        return generate_top_sources_card(dict(args[0]))
+    if name == "days_tracked":
+        return generate_days_tracked_card(*args)
+    if name == "adherence":
+        return generate_adherence_card(*args)
+    raise ValueError(f"unknown story frame '{name}'")
+
+
+def render_frame(spec: FrameSpec, palette: bool = False) -> Image.Image:
+    """render a story frame
+
+    With palette the frame is quantised for GIF here, so quantising runs
+    in parallel in the pool rather than in the encoder.
+    """
+    frame = _render(spec).convert("RGB")
+    if palette:
+        return frame.quantize(colors=256, method=Image.FASTOCTREE)
+    return frame
+
+
+def _render_frames(
+    specs: List[FrameSpec], palette: bool, pool: Optional[Executor]
+) -> List[Image.Image]:
+    if pool is None:
+        return [render_frame(spec, palette) for spec in specs]
+    return list(
+        pool.map(
+            render_frame,
+            specs,
+            [palette] * len(specs),
+            chunksize=max(1, len(specs) // 16),
+        )
+    )
+
+
+@lru_cache(maxsize=None)
+def get_frame_pool(
+    workers: Optional[int] = None,
+) -> Optional[ProcessPoolExecutor]:
+    """process pool kept for the life of the process, reusing the workers
+    keeps their card templates warm
+
+    Workers are spawned rather than forked, forking the multi-threaded
+    streamlit server can copy locks held by other threads. Returns None
+    with a single cpu, where rendering in process is faster.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers < 2:
+        return None
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+def _encode_mp4(frames: List[Image.Image], durations: List[int]) -> bytes:
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise ValueError("mp4 stories need ffmpeg on the PATH")
+    width, height = frames[0].size
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        out_path = os.path.join(tmp_dir, "story.mp4")
+        encoder = subprocess.Popen(
+            [
+                ffmpeg,
+                "-loglevel",
+                "error",
+                "-f",
+                "rawvideo",
+                "-pix_fmt",
+                "rgb24",
+                "-s",
+                f"{width}x{height}",
+                "-r",
+                str(1000 // FRAME_MS),
+                "-i",
+                "-",
+                "-pix_fmt",
+                "yuv420p",
+                "-vf",
+                "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+                out_path,
+            ],
+            stdin=subprocess.PIPE,
+        )
+        # fixed frame rate, so held frames are written repeatedly
+        with encoder.stdin as stdin:  # type: ignore
+            for frame, duration in zip(frames, durations):
+                raw = frame.tobytes()
+                for _ in range(duration // FRAME_MS):
+                    stdin.write(raw)
+        if encoder.wait() != 0:
+            raise RuntimeError("ffmpeg failed to encode the story")
+        with open(out_path, "rb") as mp4_file:
+            return mp4_file.read()
+
+
+def render_story(
+    metrics: Dict[str, Any],
+    timeline: Optional[str] = None,
+    story_format: str = "gif",
+    pool: Optional[Executor] = None,
+) -> bytes:
+    """render the wrapped story as an animated gif, webp or mp4
+
+    Args:
+        metrics (Dict[str, Any]): report.get_wrapped_metrics output
+        timeline (Optional[str]): get_tracked_timeline output
+        story_format (str): one of STORY_FORMATS
+        pool (Optional[Executor]): process pool to render frames in, e.g.
+        get_frame_pool(), frames are rendered in this process if None
+
+    Returns:
+        bytes: encoded story
+    """
+    if story_format not in STORY_FORMATS:
+        raise ValueError(f"unknown story format '{story_format}'")
+    frames = build_story_frames(metrics, timeline)
+    specs = [spec for spec, _ in frames]
+    durations = [duration for _, duration in frames]
+
+    # each distinct frame is rendered once however often it's shown
+    unique_specs = list(dict.fromkeys(specs))
+    rendered = dict(
+        zip(
+            unique_specs,
+            _render_frames(unique_specs, story_format == "gif", pool),
+        )
+    )
+    images = [rendered[spec] for spec in specs]
+
+    if story_format == "mp4":
+        return _encode_mp4(images, durations)
+    story = io.BytesIO()
+    images[0].save(
+        story,
+        format=story_format.upper(),
+        save_all=True,
+        append_images=images[1:],
+        duration=durations,
+        loop=0,
+        **({"quality": 80, "method": 0} if story_format == "webp" else {}),
+    )
+    return story.getvalue()
@@ -1,52 +1,154 @@
+import os
+from concurrent.futures import as_completed
 from datetime import date, timedelta
+from typing import Callable, Optional
 
 import pandas as pd
 import streamlit as st
 from dotenv import load_dotenv
 from httpx import ConnectTimeout
-from myfitnesspal.diary_scraping import (
-    async_get_diary_data,
-    async_scrape_diaries,
-)
+from myfitnesspal.analysis import stratified_sample_days
+from myfitnesspal.archive import DiaryArchive
+from myfitnesspal.diary_scraping import concat_diaries
+from myfitnesspal.diary_store import SharedDiaryStore
+from myfitnesspal.food_index import FoodIndex
+from myfitnesspal.instrumentation import span
+from myfitnesspal.page_cache import diary_page_cache
+from myfitnesspal.scheduler import get_scheduler
 from numerize import numerize as nz
 
 load_dotenv()
 
+# keep raw pages so parser fixes can be applied without scraping again
+diary_archive = (
+    DiaryArchive(os.environ["MFP_ARCHIVE_DIR"])
+    if os.environ.get("MFP_ARCHIVE_DIR")
+    else None
+)
+
+# canonical foods, persisted so ids are stable between runs if set
+food_index = FoodIndex(os.environ.get("MFP_FOOD_INDEX"))
+
+# parsed diaries shared between app processes on the same host if set
+diary_store = (
+    SharedDiaryStore(
+        os.environ["MFP_SHARED_STORE_DIR"],
+        max_bytes=int(os.environ.get("MFP_SHARED_STORE_MB", 1024)) * 2**20,
+    )
+    if os.environ.get("MFP_SHARED_STORE_DIR")
+    else None
+)
+
+# fetch every nth day first to show estimates while the rest loads
+PREVIEW_SAMPLE_EVERY = 7
+
+# called with the diary of the sampled days and the number of days sampled
+SampleCallback = Callable[[pd.DataFrame, int], None]
+
 
 class TooManyDaysError(Exception):
     pass
 
 
-async def async_load_mfp_data(start_date: date, end_date: date, user: str):
+def add_canonical_foods(diary_df: pd.DataFrame) -> pd.DataFrame:
+    """group variants of the same food together in analyses"""
+    diary_df["canonical_food"] = food_index.encode(diary_df["food"])
+    return diary_df
+
 
-    extracted_diaries = await async_scrape_diaries(start_date, end_date, user)
+def load_mfp_data(
+    start_date: date,
+    end_date: date,
+    user: str,
+    on_sample: Optional[SampleCallback] = None,
+    sample_every: int = PREVIEW_SAMPLE_EVERY,
+):
     prog_bar = st.progress(0)
     date_update = st.empty()
-    diary_df = pd.DataFrame()
-    progress = 0
-    num_days = (end_date - start_date).days + 1
-
-    for idx, df in enumerate(async_get_diary_data(extracted_diaries)):
-        progress = round((idx + 1) / num_days, 2)
-        prog_bar.progress(progress)
-        date_update.text(
-            f"grabbing diary for {start_date + timedelta(days=idx)}"
+    diary_dates = pd.date_range(start_date, end_date)
+    num_days = len(diary_dates)
+    diaries = [None] * num_days
+
+    # sampled days are submitted first so they're scraped first
+    sample_idxs = []
+    if on_sample is not None:
+        sample_idxs = list(
+            diary_dates.get_indexer(
+                stratified_sample_days(start_date, end_date, sample_every)
+            )
         )
-
-        diary_df = pd.concat([diary_df, df], axis=0, join="outer")
+    sampled = set(sample_idxs)
+    submit_order = sample_idxs + [
+        idx for idx in range(num_days) if idx not in sampled
+    ]
+    samples_left = len(sample_idxs)
+
+    # scraping runs on the shared background loop, this thread only waits
+    # for days to finish and updates the progress bar
+    scheduler = get_scheduler()
+    days = {
+        scheduler.load_diary_day(
+            user, diary_dates[idx], diary_page_cache, diary_archive
+        ): idx
+        for idx in submit_order
+    }
+    try:
+        for num_done, day in enumerate(as_completed(days)):
+            idx = days[day]
+            diaries[idx] = day.result()
+            prog_bar.progress(round((num_done + 1) / num_days, 2))
+            date_update.text(f"grabbing diary for {diary_dates[idx].date()}")
+
+            if idx in sampled:
+                samples_left -= 1
+                # no point estimating if everything has loaded anyway
+                if samples_left == 0 and num_done + 1 < num_days:
+                    sample_df = add_canonical_foods(
+                        concat_diaries(
+                            [diaries[sample_idx] for sample_idx in sample_idxs]
+                        )
+                    )
+                    on_sample(sample_df, len(sample_idxs))
+    finally:
+        # stop scraping the rest of the range if a day failed
+        for day in days:
+            day.cancel()
 
     date_update.empty()
 
+    # concat once, concatenating inside the loop copies the diary every day
+    with span("concat"):
+        diary_df = concat_diaries(diaries)
+    with span("canonical_foods"):
+        add_canonical_foods(diary_df)
+        food_index.save()
+
     return diary_df
 
 
-async def grab_mfp_data(start_date: date, end_date: date, user: str):
+def grab_mfp_data(
+    start_date: date,
+    end_date: date,
+    user: str,
+    on_sample: Optional[SampleCallback] = None,
+):
     if end_date - start_date > timedelta(days=365):
         raise TooManyDaysError
+    if diary_store is not None:
+        with span("shared_store"):
+            diary_df = diary_store.get(user, start_date, end_date)
+        if diary_df is not None:
+            return diary_df
     try:
-        return await async_load_mfp_data(start_date, end_date, user)
+        diary_df = load_mfp_data(
+            start_date, end_date, user, on_sample=on_sample
+        )
     except ConnectTimeout:
         raise TooManyDaysError
+    if diary_store is not None:
+        with span("shared_store"):
+            diary_store.put(user, start_date, end_date, diary_df)
+    return diary_df
 
 
 def show_metrics(metrics: dict) -> None:
@@ -0,0 +1,125 @@
+"""
+Cold start import time benchmark based on python -X importtime.
+
+Each module is imported in a fresh interpreter so nothing is cached in
+sys.modules. Run from the app directory (like the streamlit app):
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py main myfitnesspal.analysis --top 15
+    python benchmarks/import_time.py --json import_times.json --max-ms 800
+
+With --max-ms the exit code is 1 if any module takes longer, so it can
+guard cold start in CI.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODULES = [
+    "main",
+    "app_utils",
+    "myfitnesspal.analysis",
+    "myfitnesspal.diary_scraping",
+    "cli",
+]
+# importtime lines look like "import time: self | cumulative | name" with
+# the name indented two spaces per level of nesting, the imported module
+# itself is logged last with one space and its cumulative time includes
+# its own body and everything it pulled in
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)")
+# written to stderr just before the import to skip interpreter startup
+START_MARKER = "-- import start --"
+
+
+@dataclass
+class ImportTiming:
+    module: str
+    total_ms: float
+    # cumulative ms of the slowest top level packages pulled in
+    heaviest: Dict[str, float]
+
+
+def time_import(module: str, top_n: int = 10) -> ImportTiming:
+    """import module in a fresh interpreter and parse -X importtime"""
+    code = f"import sys; sys.stderr.write({START_MARKER!r}); import {module}"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=APP_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr}")
+
+    total_us = 0
+    packages: Dict[str, int] = {}
+    import_log = result.stderr.split(START_MARKER, 1)[-1]
+    for line in import_log.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match is None:
+            continue
+        _, cumulative_us, indent, name = match.groups()
+        if len(indent) == 1:
+            total_us += int(cumulative_us)
+        if "." not in name and name != module.split(".")[0]:
+            packages[name] = int(cumulative_us)
+
+    heaviest = sorted(packages.items(), key=lambda pkg: -pkg[1])[:top_n]
+    return ImportTiming(
+        module=module,
+        total_ms=round(total_us / 1000, 1),
+        heaviest={name: round(us / 1000, 1) for name, us in heaviest},
+    )
+
+
+def benchmark(
+    modules: List[str], repeat: int = 3, top_n: int = 10
+) -> List[ImportTiming]:
+    """median cold import time of each module over repeat runs"""
+    timings = []
+    for module in modules:
+        runs = [time_import(module, top_n) for _ in range(repeat)]
+        median_ms = statistics.median(run.total_ms for run in runs)
+        median_run = min(runs, key=lambda run: abs(run.total_ms - median_ms))
+        timings.append(median_run)
+    return timings
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--json", help="write timings to this json file")
+    parser.add_argument(
+        "--max-ms", type=float, help="fail if any module takes longer"
+    )
+    args = parser.parse_args(argv)
+
+    timings = benchmark(args.modules, args.repeat, args.top)
+    for timing in timings:
+        print(f"{timing.module}: {timing.total_ms:.1f} ms")
+        for name, ms in timing.heaviest.items():
+            print(f"    {ms:8.1f} ms  {name}")
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump([asdict(timing) for timing in timings], json_file)
+
+    if args.max_ms is not None:
+        too_slow = [t.module for t in timings if t.total_ms > args.max_ms]
+        if too_slow:
+            print(f"over {args.max_ms} ms: {', '.join(too_slow)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
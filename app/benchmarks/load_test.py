@@ -0,0 +1,410 @@
+"""
+Load test of the full app flow with concurrent sessions.
+
+Each simulated session runs what a streamlit run does after "Get Data":
+get_diary_for_range -> get_diary_summary -> analyse_and_plot, called
+directly on the app's functions outside a streamlit server. Every thread
+gets its own session state. Diaries come from a local stand-in for
+myfitnesspal.com (a ThreadingHTTPServer serving generated diary pages),
+so nothing is sent to the real site.
+
+Run from the app directory:
+
+    python -m benchmarks.load_test --concurrency 1 4 16 --days 7 30 90
+
+Reports p50/p95 session latency, throughput, peak RSS and the lag of the
+scraping event loop for every (concurrency, days) combination. The
+stand-in shares the process (and the GIL) with the app by default, run it
+separately to keep it out of the numbers:
+
+    python -m benchmarks.load_test --serve 8765
+    MFP_BASE_URL=http://127.0.0.1:8765 python -m benchmarks.load_test
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import resource
+import sys
+import threading
+import time
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Iterator, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+END_DATE = date(2022, 12, 31)
+SAMPLE_INTERVAL = 0.05
+LAG_PROBE_INTERVAL = 0.01
+
+# generated diary pages
+NUTRIENTS = [
+    ("Calories", "kcal"),
+    ("Carbs", "g"),
+    ("Fat", "g"),
+    ("Protein", "g"),
+    ("Sodium", "mg"),
+    ("Sugar", "g"),
+]
+MEALS = ["Breakfast", "Lunch", "Dinner", "Snacks"]
+FOODS = [
+    "Hovis - 50/50 Bread, 2 slices",
+    "hovis 50/50 bread, 1 slice",
+    "Banana, 1 medium",
+    "Chicken Thigh Cooked, 200 g",
+    "Options - Hot Chocolate, 1 sachet",
+    "Tesco - Greek Style Yoghurt, 150 g",
+    "Porridge Oats, 40 g",
+    "Semi Skimmed Milk, 200 ml",
+    "Apples - Raw with skin, 1 medium",
+    "Basmati Rice Cooked, 180 g",
+    "Salmon Fillet, 1 fillet",
+    "Cheddar Cheese, 30 g",
+]
+
+
+def _labelled_cell(value: Any, label: str) -> str:
+    return f"<td>{value}\n  <div>{label}</div></td>"
+
+
+def fake_diary_page(user: str, day: date) -> str:
+    """diary page in the layout of myfitnesspal's, the same for a user and
+    day every time it's generated"""
+    rng = random.Random(f"{user}/{day}")
+    nutrient_headers = "".join(
+        _labelled_cell(name, unit) for name, unit in NUTRIENTS
+    )
+    rows = [f"<tr><td>{MEALS[0]}</td>{nutrient_headers}<td></td></tr>"]
+    for idx, meal in enumerate(MEALS):
+        if idx:
+            rows.append("<tr><td>&nbsp;</td></tr>")
+            rows.append(f"<tr><td>{meal}</td>{'<td></td>' * 7}</tr>")
+        for _ in range(rng.randint(0 if meal == "Snacks" else 1, 4)):
+            macros = "".join(
+                _labelled_cell(grams, f"{rng.randint(0, 100)}%")
+                for grams in (rng.randint(0, 60) for _ in range(3))
+            )
+            rows.append(
+                f"<tr><td>{rng.choice(FOODS)}</td>"
+                f"<td>{rng.randint(30, 700)}</td>{macros}"
+                f"<td>{rng.randint(0, 900)}</td><td>{rng.randint(0, 30)}</td>"
+                "<td></td></tr>"
+            )
+        rows.append(
+            f"<tr><td>Add Food\n  Quick Tools</td>{'<td>0</td>' * 6}"
+            "<td></td></tr>"
+        )
+    goals = "".join(_labelled_cell(grams, "") for grams in (250, 70, 150))
+    rows += [
+        f"<tr><td>Totals</td>{'<td>1</td>' * 6}<td></td></tr>",
+        f"<tr><td>Your Daily Goal</td><td>2200</td>{goals}"
+        "<td>2300</td><td>90</td><td></td></tr>",
+        f"<tr><td>Remaining</td>{'<td>1</td>' * 6}<td></td></tr>",
+        f"<tr><td></td>{nutrient_headers}<td></td></tr>",
+    ]
+    return (
+        f"<html><body><table id='diary-table'>{''.join(rows)}</table>"
+        "</body></html>"
+    )
+
+
+class FakeMfpHandler(BaseHTTPRequestHandler):
+    """serves /food/diary/<user>?date=YYYY-MM-DD with etags"""
+
+    protocol_version = "HTTP/1.1"
+    server: "FakeMfpServer"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        user = re.fullmatch(r"/food/diary/([^/]+)", url.path)
+        day = parse_qs(url.query).get("date", [""])[0][:10]
+        if user is None or not day:
+            self._respond(404)
+            return
+        time.sleep(self.server.latency)
+        html = fake_diary_page(user.group(1), date.fromisoformat(day))
+        etag = f'"{hashlib.md5(html.encode()).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self._respond(304, etag=etag)
+        else:
+            self._respond(200, html.encode(), etag)
+
+    def _respond(
+        self, status: int, body: bytes = b"", etag: Optional[str] = None
+    ):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        if body:
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+        if etag:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeMfpServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0.05):
+        super().__init__(("127.0.0.1", port), FakeMfpHandler)
+        self.latency = latency
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class ThreadSessionState(MutableMapping):
+    """st.session_state stand-in giving every thread its own session"""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @property
+    def _state(self) -> dict:
+        if not hasattr(self._local, "state"):
+            self._local.state = {}
+        return self._local.state
+
+    def reset(self) -> None:
+        self._local.state = {}
+
+    def __getitem__(self, key):
+        return self._state[key]
+
+    def __setitem__(self, key, value):
+        self._state[key] = value
+
+    def __delitem__(self, key):
+        del self._state[key]
+
+    def __iter__(self) -> Iterator:
+        return iter(self._state)
+
+    def __len__(self) -> int:
+        return len(self._state)
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # peak rather than current outside linux, in KB
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ResourceSampler:
+    """peak RSS of the process and lag of the scraping event loop while
+    active"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.peak_rss = 0
+        self.loop_lags: List[float] = []
+        self._stop = threading.Event()
+
+    def _sample_rss(self) -> None:
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            self.peak_rss = max(self.peak_rss, _rss_bytes())
+
+    async def _probe_loop(self) -> None:
+        # time over the requested sleep is time the loop was busy
+        while not self._stop.is_set():
+            started = self.loop.time()
+            await asyncio.sleep(LAG_PROBE_INTERVAL)
+            lag = self.loop.time() - started - LAG_PROBE_INTERVAL
+            self.loop_lags.append(max(lag, 0))
+
+    def __enter__(self) -> "ResourceSampler":
+        self.peak_rss = _rss_bytes()
+        self._rss_thread = threading.Thread(
+            target=self._sample_rss, daemon=True
+        )
+        self._rss_thread.start()
+        self._probe = asyncio.run_coroutine_threadsafe(
+            self._probe_loop(), self.loop
+        )
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._rss_thread.join()
+        self._probe.result()
+
+
+@dataclass
+class LoadResult:
+    concurrency: int
+    days: int
+    sessions: int
+    errors: int
+    p50_s: float
+    p95_s: float
+    throughput: float
+    peak_rss_mb: float
+    loop_lag_p95_ms: float
+    loop_lag_max_ms: float
+
+
+def run_session(user: str, start_date: date, end_date: date) -> float:
+    """run the app flow for a new session, returns its latency"""
+    import main
+    import streamlit as st
+
+    st.session_state.reset()  # type: ignore
+    started = time.perf_counter()
+    main.show_landing_page()
+    diary_df = main.get_diary_for_range(start_date, end_date, user)
+    summary = main.get_diary_summary(diary_df, start_date, end_date, user)
+    main.analyse_and_plot(diary_df, summary)
+    return time.perf_counter() - started
+
+
+def run_load(
+    concurrency: int, days: int, sessions: int, num_users: int, run_id: str
+) -> LoadResult:
+    """run sessions over a pool of concurrency threads"""
+    from myfitnesspal.scheduler import get_scheduler
+
+    start_date = END_DATE - timedelta(days=days - 1)
+    # fresh users per run so each run scrapes, unless they're shared
+    users = [f"{run_id}user{idx % num_users}" for idx in range(sessions)]
+    latencies, errors = [], 0
+    with ResourceSampler(get_scheduler().loop) as sampler:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            runs = [
+                pool.submit(run_session, user, start_date, END_DATE)
+                for user in users
+            ]
+            for run in runs:
+                try:
+                    latencies.append(run.result())
+                except Exception as error:
+                    errors += 1
+                    print(f"session failed: {error!r}", file=sys.stderr)
+        elapsed = time.perf_counter() - started
+
+    lags = sampler.loop_lags or [0.0]
+    p50, p95 = np.percentile(latencies, [50, 95]) if latencies else (0, 0)
+    return LoadResult(
+        concurrency=concurrency,
+        days=days,
+        sessions=sessions,
+        errors=errors,
+        p50_s=round(float(p50), 3),
+        p95_s=round(float(p95), 3),
+        throughput=round(len(latencies) / elapsed, 2),
+        peak_rss_mb=round(sampler.peak_rss / 2**20, 1),
+        loop_lag_p95_ms=round(float(np.percentile(lags, 95)) * 1000, 1),
+        loop_lag_max_ms=round(max(lags) * 1000, 1),
+    )
+
+
+def print_results(results: List[LoadResult]) -> None:
+    columns = list(asdict(results[0]))
+    widths = [max(len(col), 8) for col in columns]
+    print("  ".join(col.rjust(w) for col, w in zip(columns, widths)))
+    for result in results:
+        values = asdict(result).values()
+        print("  ".join(str(v).rjust(w) for v, w in zip(values, widths)))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.load_test",
+        description="Load test the app flow with concurrent sessions",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[1, 4, 16]
+    )
+    parser.add_argument("--days", type=int, nargs="+", default=[7, 30, 90])
+    parser.add_argument(
+        "--sessions",
+        type=int,
+        default=None,
+        help="sessions per run, defaults to 2x concurrency",
+    )
+    parser.add_argument(
+        "--users",
+        type=int,
+        default=None,
+        help="distinct users per run, defaults to one per session",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=50,
+        help="stand-in response time in ms",
+    )
+    parser.add_argument(
+        "--serve",
+        type=int,
+        metavar="PORT",
+        help="only run the myfitnesspal stand-in on this port",
+    )
+    parser.add_argument("--json", help="write results to this json file")
+    args = parser.parse_args(argv)
+
+    if args.serve is not None:
+        server = FakeMfpServer(args.serve, args.latency / 1000)
+        print(f"serving diaries on {server.url}")
+        server.serve_forever()
+        return 0
+
+    server = None
+    if not os.environ.get("MFP_BASE_URL"):
+        server = FakeMfpServer(latency=args.latency / 1000)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        # read when the scraper is imported
+        os.environ["MFP_BASE_URL"] = server.url
+
+    import streamlit as st
+
+    # st calls outside a streamlit server warn on every call
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    st.session_state = ThreadSessionState()  # type: ignore
+
+    results = []
+    for days in args.days:
+        for concurrency in args.concurrency:
+            sessions = args.sessions or 2 * concurrency
+            result = run_load(
+                concurrency,
+                days,
+                sessions,
+                args.users or sessions,
+                run_id=f"c{concurrency}d{days}",
+            )
+            results.append(result)
+            print(
+                f"{concurrency} concurrent sessions, {days} days: "
+                f"p95 {result.p95_s}s",
+                file=sys.stderr,
+            )
+    print_results(results)
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump([asdict(result) for result in results], json_file)
+    if server is not None:
+        server.shutdown()
+    return 1 if any(result.errors for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
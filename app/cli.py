@@ -0,0 +1,288 @@
+"""
+Headless batch mode to generate wrapped reports for many users
+
+Reads a csv of jobs with columns user,start_date,end_date (dates are
+optional if --start/--end are passed) and writes the wrapped cards as png
+plus a metrics.json for each user to <out_dir>/<user>/. With --story an
+animated story (gif, webp or mp4) is written there too, and with --export
+the diary and daily totals as csv, parquet or ndjson.
+
+Run from the app directory (like the streamlit app) so assets resolve:
+
+    python cli.py jobs.csv reports/ --start 2022-01-01 --end 2022-12-31
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import date
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+from app_utils.report import (
+    generate_wrapped_cards,
+    get_top_sources_metrics,
+    get_wrapped_metrics,
+)
+from app_utils.story import STORY_FORMATS, get_tracked_timeline, render_story
+from httpx import AsyncClient, Limits
+from myfitnesspal.analysis import summarise_diary
+from myfitnesspal.archive import safe_user_dirname
+from myfitnesspal.diary_scraping import (
+    async_scrape_diaries,
+    concat_diaries,
+    parse_diary_page,
+)
+from myfitnesspal.export import EXPORT_FORMATS, write_export
+from myfitnesspal.food_index import FoodIndex
+
+
+@dataclass(frozen=True)
+class ReportJob:
+    user: str
+    start_date: date
+    end_date: date
+
+
+def read_jobs(
+    path: str,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+) -> List[ReportJob]:
+    """read jobs csv, missing dates default to start_date/end_date"""
+    jobs = []
+    with open(path, newline="") as jobs_file:
+        for row in csv.DictReader(jobs_file):
+            start = row.get("start_date") or start_date
+            end = row.get("end_date") or end_date
+            if not start or not end:
+                raise ValueError(f"no date range for user '{row['user']}'")
+            jobs.append(
+                ReportJob(
+                    row["user"].strip(),
+                    pd.Timestamp(start).date(),
+                    pd.Timestamp(end).date(),
+                )
+            )
+    return jobs
+
+
+@lru_cache(maxsize=None)
+def get_food_index() -> FoodIndex:
+    """food index of the app, loaded once per worker and never saved as
+    workers run concurrently"""
+    return FoodIndex(os.environ.get("MFP_FOOD_INDEX"))
+
+
+def build_report(
+    job: ReportJob,
+    pages: List[Tuple[date, str]],
+    out_dir: str,
+    story_format: Optional[str] = None,
+    export_format: Optional[str] = None,
+) -> Dict[str, Any]:
+    """parse scraped pages, analyse diary and write cards and metrics
+
+    Runs in a worker process so parsing and rendering don't block scraping.
+    """
+    diary_df = concat_diaries(
+        parse_diary_page(html, diary_date) for diary_date, html in pages
+    )
+    diary_df["canonical_food"] = get_food_index().encode(diary_df["food"])
+    summary = summarise_diary(diary_df, job.start_date, job.end_date)
+    metrics = get_wrapped_metrics(summary)
+    metrics["top_sources"] = get_top_sources_metrics(diary_df)
+    metrics["user"] = job.user
+
+    # usernames come from the jobs csv, don't let them escape out_dir
+    user_dir = os.path.join(out_dir, safe_user_dirname(job.user))
+    os.makedirs(user_dir, exist_ok=True)
+    for name, card in generate_wrapped_cards(metrics).items():
+        card.save(os.path.join(user_dir, f"{name}.png"))
+    if story_format:
+        # already in a worker, users are rendered in parallel instead
+        story = render_story(
+            metrics, get_tracked_timeline(summary), story_format
+        )
+        story_path = os.path.join(user_dir, f"story.{story_format}")
+        with open(story_path, "wb") as story_file:
+            story_file.write(story)
+    if export_format:
+        extension = EXPORT_FORMATS[export_format].extension
+        write_export(
+            diary_df,
+            os.path.join(user_dir, f"diary{extension}"),
+            export_format,
+        )
+        write_export(
+            summary.daily,
+            os.path.join(user_dir, f"daily{extension}"),
+            export_format,
+            index=True,
+        )
+    with open(os.path.join(user_dir, "metrics.json"), "w") as metrics_file:
+        json.dump(metrics, metrics_file, indent=2)
+    return metrics
+
+
+async def run_job(
+    job: ReportJob,
+    out_dir: str,
+    client: AsyncClient,
+    request_limit: asyncio.Semaphore,
+    user_limit: asyncio.Semaphore,
+    pool: ProcessPoolExecutor,
+    story_format: Optional[str] = None,
+    export_format: Optional[str] = None,
+) -> Optional[str]:
+    """scrape and render one report, returns an error message on failure"""
+    async with user_limit:
+        try:
+            extracted_diaries = await async_scrape_diaries(
+                job.start_date,
+                job.end_date,
+                job.user,
+                client=client,
+                semaphore=request_limit,
+            )
+            pages = [
+                (page.diary_date, page.html) for page in extracted_diaries
+            ]
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                pool,
+                build_report,
+                job,
+                pages,
+                out_dir,
+                story_format,
+                export_format,
+            )
+        except Exception as error:  # keep going for the other users
+            return f"{job.user}: {error!r}"
+    return None
+
+
+async def run_batch(
+    jobs: List[ReportJob],
+    out_dir: str,
+    max_requests: int = 20,
+    max_users: int = 8,
+    workers: Optional[int] = None,
+    story_format: Optional[str] = None,
+    export_format: Optional[str] = None,
+) -> List[str]:
+    """generate reports for all jobs, returns errors for failed jobs
+
+    Args:
+        jobs (List[ReportJob]): users and date ranges to report on
+        out_dir (str): directory reports are written to
+        max_requests (int): max requests to myfitnesspal in flight across
+        all users
+        max_users (int): max users being scraped/rendered at once, bounds
+        memory held by scraped pages
+        workers (Optional[int]): size of process pool for parsing/rendering
+        story_format (Optional[str]): also render an animated story in this
+        format, see app_utils.story.STORY_FORMATS
+        export_format (Optional[str]): also export the diary and daily
+        totals in this format, see myfitnesspal.export.EXPORT_FORMATS
+
+    Returns:
+        List[str]: error messages for jobs that failed
+    """
+    request_limit = asyncio.Semaphore(max_requests)
+    user_limit = asyncio.Semaphore(max_users)
+    limits = Limits(
+        max_connections=max_requests, max_keepalive_connections=max_requests
+    )
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        async with AsyncClient(limits=limits, timeout=30) as client:
+            errors = await asyncio.gather(
+                *[
+                    run_job(
+                        job,
+                        out_dir,
+                        client,
+                        request_limit,
+                        user_limit,
+                        pool,
+                        story_format,
+                        export_format,
+                    )
+                    for job in jobs
+                ]
+            )
+    return [error for error in errors if error]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Generate myfitnesspal wrapped reports in batch"
+    )
+    parser.add_argument("jobs", help="csv with user,start_date,end_date")
+    parser.add_argument("out_dir", help="directory to write reports to")
+    parser.add_argument("--start", help="default start date (YYYY-MM-DD)")
+    parser.add_argument("--end", help="default end date (YYYY-MM-DD)")
+    parser.add_argument(
+        "--max-requests",
+        type=int,
+        default=20,
+        help="max concurrent requests to myfitnesspal",
+    )
+    parser.add_argument(
+        "--max-users",
+        type=int,
+        default=8,
+        help="max users processed at once",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="render process pool size"
+    )
+    parser.add_argument(
+        "--story",
+        choices=STORY_FORMATS,
+        help="also write an animated story in this format",
+    )
+    parser.add_argument(
+        "--export",
+        choices=list(EXPORT_FORMATS),
+        help="also write the diary and daily totals in this format",
+    )
+    args = parser.parse_args(argv)
+
+    jobs = read_jobs(
+        args.jobs,
+        date.fromisoformat(args.start) if args.start else None,
+        date.fromisoformat(args.end) if args.end else None,
+    )
+    start_time = time.perf_counter()
+    errors = asyncio.run(
+        run_batch(
+            jobs,
+            args.out_dir,
+            args.max_requests,
+            args.max_users,
+            args.workers,
+            args.story,
+            args.export,
+        )
+    )
+    elapsed = time.perf_counter() - start_time
+
+    for error in errors:
+        print(error, file=sys.stderr)
+    print(
+        f"generated {len(jobs) - len(errors)}/{len(jobs)} reports in "
+        f"{elapsed:.2f} seconds"
+    )
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,40 +1,52 @@
 """
 Entry point for streamlit app
 """
-import asyncio
+import os
 import time
 from datetime import date, datetime, timedelta
+from typing import TYPE_CHECKING, Optional
 
-import pandas as pd
 import streamlit as st
-from app_utils import TooManyDaysError, grab_mfp_data, show_metrics
-from app_utils.cards import (
-    generate_adherence_card,
-    generate_days_tracked_card,
-    generate_top_foods_card,
-    generate_total_kcal_card,
-)
-from app_utils.plots import (
-    plot_intake_goals,
-    plot_macro_treemap,
-    plot_most_common,
-)
-from myfitnesspal.analysis import (
-    get_adherence_perc,
-    get_intake_goals,
-    get_longest_streaks,
-    get_most_common,
-    get_total_logged_days,
-    total_macros,
-    unpivot_food_macros,
+from app_utils.profiling import profile_run, should_profile
+from myfitnesspal.instrumentation import (
+    span,
+    start_metrics_server,
+    trace_run,
 )
 
+# pandas, plotly, PIL and the scraper are imported where they're used so
+# the landing page loads without them
+if TYPE_CHECKING:
+    import pandas as pd
+    from app_utils.utils import SampleCallback
+    from myfitnesspal.analysis import DiarySummary
+
+# show estimates from a sample of days first for ranges at least this long
+PREVIEW_MIN_DAYS = 28
+# show trends for ranges at least this long
+TRENDS_MIN_DAYS = 28
+TREND_MACROS = {
+    "calories": "calories_kcal",
+    "carbs": "carbs_g",
+    "fat": "fat_g",
+    "protein": "protein_g",
+}
+
+
+def get_diary_for_range(
+    start_date: date,
+    end_date: date,
+    mfp_user: str,
+    on_sample: Optional["SampleCallback"] = None,
+):
+    from app_utils import TooManyDaysError, grab_mfp_data
 
-async def get_diary_for_range(start_date: date, end_date: date, mfp_user: str):
     try:
         start_time = time.perf_counter()
 
-        scraped_diary_df = await grab_mfp_data(start_date, end_date, mfp_user)
+        scraped_diary_df = grab_mfp_data(
+            start_date, end_date, mfp_user, on_sample=on_sample
+        )
         diary_df = scraped_diary_df.copy()
 
         elapsed = time.perf_counter() - start_time
@@ -57,41 +69,167 @@ async def get_diary_for_range(start_date: date, end_date: date, mfp_user: str):
     return diary_df
 
 
-def analyse_and_plot(diary_df: pd.DataFrame, start_date: date, end_date: date):
+def show_preview(
+    sample_df: "pd.DataFrame",
+    num_sampled_days: int,
+    start_date: date,
+    end_date: date,
+):
     """
-    main function to add data plots to page
+    show estimated cards and totals from a sample of days
     """
+    from app_utils import show_metrics
+    from app_utils.report import generate_wrapped_cards, get_estimated_metrics
+    from myfitnesspal.analysis import summarise_diary
 
-    num_days_tracked = get_total_logged_days(diary_df)
-    total_num_days = (end_date - start_date).days + 1
+    with span("preview"):
+        sample_summary = summarise_diary(sample_df, start_date, end_date)
+        metrics = get_estimated_metrics(sample_summary, num_sampled_days)
+        cards = generate_wrapped_cards(metrics)
 
-    most_common_foods = get_most_common(diary_df)
-    melted_food_df = unpivot_food_macros(
-        diary_df,
+    st.info(
+        f"Estimates from {num_sampled_days} of {metrics['total_days']} "
+        "days - these will be replaced once every day has loaded"
     )
-    intake_goals = get_intake_goals(diary_df)
-    tolerance = 0.1
-    adherence_perc = get_adherence_perc(intake_goals, perc_tolerance=tolerance)
-    total_macro_metrics = total_macros(diary_df)
-    longest_streak, longest_blank = get_longest_streaks(diary_df)
-    kcal_card = generate_total_kcal_card(
-        total_macro_metrics["Calories (kcal)"]
+    col1, col2, col3, _ = st.columns(4)
+    col1.image(cards["total_kcal"])
+    col2.image(cards["top_foods"])
+    col3.image(cards["adherence"])
+    st.metric(
+        "Total days logged (estimate)",
+        f"~{metrics['days_tracked']}/{metrics['total_days']}",
     )
-    top5_card = generate_top_foods_card(
-        most_common_foods[:5].to_dict()  # type:ignore
+
+    st.header("Totals (estimate)")
+    show_metrics(metrics["totals"])
+
+
+def get_diary_summary(
+    diary_df: "pd.DataFrame", start_date: date, end_date: date, mfp_user: str
+) -> "DiarySummary":
+    """
+    summarise the range, reusing days already summarised in this session
+    """
+    from myfitnesspal.analysis import extend_summary
+
+    summaries = st.session_state.setdefault("diary_summaries", {})
+    with span("summary"):
+        summary = extend_summary(
+            summaries.get(mfp_user),
+            diary_df,
+            start_date,
+            end_date,
+            fresh_before=_fresh_before(),
+        )
+    summaries[mfp_user] = summary
+    return summary.clip(start_date, end_date)
+
+
+def _fresh_before() -> date:
+    # recent days may have been logged since they were last summarised
+    return datetime.now().date() - timedelta(days=1)
+
+
+def get_session_rolling_averages(
+    start_date: date, end_date: date, mfp_user: str
+) -> "pd.DataFrame":
+    """
+    rolling averages of the range, extending the ones already rolled in
+    this session from the same start date (call after get_diary_summary)
+    """
+    import pandas as pd
+    from myfitnesspal.trends import (
+        extend_rolling_averages,
+        get_rolling_averages,
     )
-    days_tracked_card = generate_days_tracked_card(
-        num_days_tracked, total_num_days, longest_streak, longest_blank
+
+    # the session summary covers at least the range, and any days after it
+    # that were loaded before are rolled too for the next, longer range
+    daily = st.session_state["diary_summaries"][mfp_user].daily
+    daily = daily[daily.index >= pd.Timestamp(start_date)]
+    rolled = st.session_state.setdefault("rolling_averages", {})
+    with span("rolling_averages"):
+        cached = rolled.get(mfp_user)
+        if cached is not None and cached[0] == start_date:
+            # windows only look back, so the rolled days stay valid apart
+            # from the ones summarised again
+            rolling = extend_rolling_averages(
+                cached[1], daily, changed_from=_fresh_before()
+            )
+        else:
+            rolling = get_rolling_averages(daily)
+    rolled[mfp_user] = (start_date, rolling)
+    return rolling[rolling.index <= pd.Timestamp(end_date)]
+
+
+def analyse_and_plot(
+    diary_df: "pd.DataFrame",
+    summary: "DiarySummary",
+    make_story: bool = False,
+    rolling_df: Optional["pd.DataFrame"] = None,
+):
+    """
+    main function to add data plots to page, trends use rolling_df if it's
+    given (see get_session_rolling_averages)
+    """
+    from app_utils import show_metrics
+    from app_utils.plots import (
+        plot_adherence_curves,
+        plot_intake_goals,
+        plot_macro_treemap,
+        plot_most_common,
     )
-    adherence_card = generate_adherence_card(
-        adherence_perc, tolerance=tolerance
+    from app_utils.report import (
+        ADHERENCE_TOLERANCE,
+        generate_wrapped_cards,
+        get_top_sources_metrics,
+        get_wrapped_metrics,
     )
-    col1, col2, col3, col4 = st.columns(4)
+    from myfitnesspal.analysis import unpivot_food_macros
 
-    col1.image(kcal_card)
-    col2.image(top5_card)
-    col3.image(days_tracked_card)
-    col4.image(adherence_card)
+    with span("analysis"):
+        metrics = get_wrapped_metrics(summary)
+        metrics["top_sources"] = get_top_sources_metrics(diary_df)
+        num_days_tracked = metrics["days_tracked"]
+        total_num_days = metrics["total_days"]
+        total_macro_metrics = metrics["totals"]
+
+        most_common_foods = summary.most_common()
+        melted_food_df = unpivot_food_macros(
+            diary_df,
+        )
+        intake_goals = summary.daily
+        adherence_curves_df = summary.adherence_curves().to_frame()
+    with span("cards"):
+        cards = generate_wrapped_cards(metrics)
+    with span("plots"):
+        most_common_fig = plot_most_common(most_common_foods)
+        treemap_fig = plot_macro_treemap(
+            melted_food_df, st.session_state["selected_macro"]
+        )
+        intake_goals_fig = plot_intake_goals(
+            intake_goals,
+            calories=st.session_state["show_calories"],
+            units=st.session_state["selected_intake_units"],
+        )
+        adherence_fig = plot_adherence_curves(
+            adherence_curves_df,
+            macro=st.session_state["selected_adherence_macro"],
+            tolerance=ADHERENCE_TOLERANCE,
+        )
+    card_order = [
+        "total_kcal",
+        "top_foods",
+        "top_sources",
+        "days_tracked",
+        "adherence",
+    ]
+    # top sources is missing if nothing was logged
+    shown_cards = [cards[name] for name in card_order if name in cards]
+    for col, card in zip(st.columns(len(shown_cards)), shown_cards):
+        col.image(card)
+    if make_story:
+        show_story(metrics, summary)
     st.metric(
         "Total days logged",
         f"{num_days_tracked}/{total_num_days}",
@@ -99,14 +237,9 @@ def analyse_and_plot(diary_df: pd.DataFrame, start_date: date, end_date: date):
 
     st.header("Totals")
     show_metrics(total_macro_metrics)
-    st.plotly_chart(
-        plot_most_common(most_common_foods), use_container_width=True
-    )
+    st.plotly_chart(most_common_fig, use_container_width=True)
 
-    st.plotly_chart(
-        plot_macro_treemap(melted_food_df, st.session_state["selected_macro"]),
-        use_container_width=True,
-    )
+    st.plotly_chart(treemap_fig, use_container_width=True)
     st.radio(
         "View breakdown for:",
         ["all", "carbs", "fat", "protein"],
@@ -125,14 +258,7 @@ def analyse_and_plot(diary_df: pd.DataFrame, start_date: date, end_date: date):
         unsafe_allow_html=True,
     )
 
-    st.plotly_chart(
-        plot_intake_goals(
-            intake_goals,
-            calories=st.session_state["show_calories"],
-            units=st.session_state["selected_intake_units"],
-        ),
-        use_container_width=True,
-    )
+    st.plotly_chart(intake_goals_fig, use_container_width=True)
     radio_col_1, radio_col_2 = st.columns(2)
     with radio_col_1:
         st.checkbox(
@@ -150,6 +276,169 @@ def analyse_and_plot(diary_df: pd.DataFrame, start_date: date, end_date: date):
             disabled=st.session_state["show_calories"],
         )
 
+    st.plotly_chart(adherence_fig, use_container_width=True)
+    st.radio(
+        "Adherence for:",
+        ["all", "calories", "carbs", "fat", "protein"],
+        key="selected_adherence_macro",
+    )
+
+    # diaries parsed before meals were captured don't have them
+    if "meal" in diary_df.columns and len(diary_df):
+        show_meals(diary_df)
+
+    if total_num_days >= TRENDS_MIN_DAYS:
+        show_trends(intake_goals, rolling_df)
+
+    show_export(diary_df, intake_goals)
+
+
+def show_story(metrics: dict, summary: "DiarySummary"):
+    """
+    add the animated wrapped story and a button to download it
+    """
+    from app_utils.story import (
+        get_frame_pool,
+        get_tracked_timeline,
+        render_story,
+    )
+
+    # redrawing the report (e.g. after a download) reuses the story
+    drawn = st.session_state.get("story")
+    if drawn is not None and drawn[0] is summary:
+        story = drawn[1]
+    else:
+        with span("story"):
+            story = render_story(
+                metrics,
+                get_tracked_timeline(summary),
+                story_format="gif",
+                pool=get_frame_pool(),
+            )
+        st.session_state["story"] = (summary, story)
+    with st.expander("Your wrapped story", expanded=True):
+        st.image(story)
+        st.download_button(
+            "Download story",
+            story,
+            file_name="mfp-wrapped.gif",
+            mime="image/gif",
+        )
+
+
+def show_meals(diary_df: "pd.DataFrame"):
+    """
+    add calories by meal and each meal's most common foods to page
+    """
+    from app_utils.plots import plot_meal_intake
+    from myfitnesspal.analysis import (
+        get_meal_aggregates,
+        get_meal_intake,
+        get_meal_most_common,
+        get_meal_split,
+    )
+
+    with span("meals"):
+        meal_aggregates = get_meal_aggregates(diary_df)
+        meal_split = get_meal_split(meal_aggregates)
+        meal_most_common = get_meal_most_common(meal_aggregates, top_n=3)
+        meal_fig = plot_meal_intake(get_meal_intake(meal_aggregates))
+
+    st.header("Meals")
+    st.plotly_chart(meal_fig, use_container_width=True)
+    for col, (meal, share) in zip(
+        st.columns(len(meal_split)), meal_split.items()
+    ):
+        col.metric(meal, f"{share:.0%} of calories")
+        for food, entries in meal_most_common[meal].items():
+            col.caption(f"{food} ({entries} entries)")
+
+
+def show_trends(
+    daily_data: "pd.DataFrame", rolling_df: Optional["pd.DataFrame"] = None
+):
+    """
+    add rolling averages, weekday patterns and monthly changes to page
+    """
+    from app_utils.plots import plot_rolling_averages, plot_weekday_profile
+    from myfitnesspal.trends import (
+        get_monthly_changes,
+        get_rolling_averages,
+        get_weekday_profile,
+        get_weekend_split,
+    )
+
+    column = TREND_MACROS[st.session_state["selected_trend_macro"]]
+    with span("trends"):
+        if rolling_df is None:
+            rolling_df = get_rolling_averages(daily_data)
+        weekday_df = get_weekday_profile(daily_data)
+        weekend_df = get_weekend_split(daily_data)
+        monthly_df = get_monthly_changes(daily_data)
+        rolling_fig = plot_rolling_averages(daily_data, rolling_df, column)
+        weekday_fig = plot_weekday_profile(weekday_df, column)
+
+    st.header("Your trends")
+    st.plotly_chart(rolling_fig, use_container_width=True)
+    st.radio("Trends for:", list(TREND_MACROS), key="selected_trend_macro")
+
+    weekday_col, weekend_col = st.columns([2, 1])
+    weekday_col.plotly_chart(weekday_fig, use_container_width=True)
+    with weekend_col:
+        st.subheader("Weekdays vs weekends")
+        for days, intake in weekend_df[column].items():
+            st.metric(f"Average on {days}s", f"{intake:,.0f}")
+
+    if len(monthly_df) > 1:
+        st.subheader("Month on month")
+        st.dataframe(
+            monthly_df[[column, f"{column}_change"]]
+            .rename(
+                columns={
+                    column: "daily average",
+                    f"{column}_change": "change",
+                }
+            )
+            .style.format(
+                {"daily average": "{:,.0f}", "change": "{:+.1%}"}, na_rep="-"
+            )
+        )
+
+
+def show_export(diary_df: "pd.DataFrame", daily_data: "pd.DataFrame"):
+    """
+    add a button to prepare the diary and per-day summary downloads
+    """
+    from myfitnesspal.export import EXPORT_FORMATS, spool_export
+
+    st.header("Download your data")
+    st.radio("Format:", list(EXPORT_FORMATS), key="selected_export_format")
+    export_format = st.session_state["selected_export_format"]
+    extension, mime = EXPORT_FORMATS[export_format]
+
+    # files are only built on the run the user asks for them, and streamed
+    # to temporary files rather than joined in memory
+    if not st.button("Prepare download"):
+        return
+    with span("export"):
+        diary_file = spool_export(diary_df, export_format)
+        daily_file = spool_export(daily_data, export_format, index=True)
+
+    diary_col, daily_col = st.columns(2)
+    with diary_file, daily_file:
+        diary_col.download_button(
+            "Download diary",
+            diary_file,
+            file_name=f"mfp-diary{extension}",
+            mime=mime,
+        )
+        daily_col.download_button(
+            "Download daily totals",
+            daily_file,
+            file_name=f"mfp-daily{extension}",
+            mime=mime,
+        )
+
 
 def show_landing_page():
     """
@@ -161,6 +450,12 @@ def show_landing_page():
     # intake vs goals chart option
     st.session_state["show_calories"] = False
     st.session_state["selected_intake_units"] = "calories"
+    # adherence chart option
+    st.session_state["selected_adherence_macro"] = "all"
+    # trends option
+    st.session_state["selected_trend_macro"] = "calories"
+    # data export option
+    st.session_state["selected_export_format"] = "csv"
 
     starter_msg = st.empty()
     starter_img = st.empty()
@@ -179,7 +474,23 @@ def show_landing_page():
         )
 
 
-async def main():
+def debug_enabled() -> bool:
+    """show debug panel if MFP_DEBUG is set or ?debug=1 is in the url"""
+    if os.environ.get("MFP_DEBUG"):
+        return True
+    debug_param = st.experimental_get_query_params().get("debug", [""])[0]
+    return debug_param not in ("", "0", "false")
+
+
+def show_debug_panel(trace):
+    with st.expander("Debug: timings"):
+        st.table(trace.stage_summary())
+        st.json(dict(trace.counters))
+
+
+def main():
+    if os.environ.get("MFP_METRICS_PORT"):
+        start_metrics_server(int(os.environ["MFP_METRICS_PORT"]))
     st.set_page_config(  # type:ignore
         "mfp wrapped",
         page_icon="images/mfp-icon.png",
@@ -200,6 +511,7 @@ async def main():
                 "myfitnesspal username", "ismailmo", placeholder="username"
             )
             st.caption("Don't forget to make your diary public!")
+            make_story = st.checkbox("Create an animated story")
             today = datetime.now().date()
             try:
                 start_date, end_date = st.date_input(
@@ -218,9 +530,51 @@ async def main():
         show_landing_page()
     if start_btn:
         # run analysis if welcome page already viewed
-        diary_df = await get_diary_for_range(start_date, end_date, mfp_user)
-        analyse_and_plot(diary_df, start_date, end_date)
+        profile = should_profile(st.experimental_get_query_params())
+        with trace_run() as trace, profile_run(
+            mfp_user, enabled=profile
+        ) as profile_report:
+            # estimates and then the full results are drawn in here
+            results = st.empty()
+
+            def on_sample(sample_df: "pd.DataFrame", num_sampled_days: int):
+                with results.container():
+                    show_preview(
+                        sample_df, num_sampled_days, start_date, end_date
+                    )
+
+            long_range = (end_date - start_date).days + 1 >= PREVIEW_MIN_DAYS
+            diary_df = get_diary_for_range(
+                start_date,
+                end_date,
+                mfp_user,
+                on_sample=on_sample if long_range else None,
+            )
+            summary = get_diary_summary(
+                diary_df, start_date, end_date, mfp_user
+            )
+            rolling_df = None
+            if summary.total_days >= TRENDS_MIN_DAYS:
+                rolling_df = get_session_rolling_averages(
+                    start_date, end_date, mfp_user
+                )
+            with results.container():
+                analyse_and_plot(diary_df, summary, make_story, rolling_df)
+        st.session_state["last_report"] = (
+            diary_df,
+            summary,
+            make_story,
+            rolling_df,
+        )
+        if debug_enabled():
+            show_debug_panel(trace)
+            if profile_report.report_path:
+                st.caption(f"profile written to {profile_report.report_path}")
+    elif "last_report" in st.session_state:
+        # widgets in the report rerun the script, redraw the last report
+        # rather than scraping it again
+        analyse_and_plot(*st.session_state["last_report"])
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()
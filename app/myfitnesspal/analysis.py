@@ -1,11 +1,27 @@
 """
 Helper functions to analyse myfitnesspal diary data
 """
-from typing import Dict, Tuple
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 
 
+def get_food_keys(diary_df: pd.DataFrame) -> pd.Series:
+    """foods to group a diary on, named "food"
+
+    Uses the canonical_food column (see food_index) if the diary has one so
+    variants of a food are grouped together on integer codes, otherwise
+    the raw food names. Group with observed=True as canonical foods are a
+    categorical.
+    """
+    if "canonical_food" in diary_df.columns:
+        return diary_df["canonical_food"].rename("food")
+    return diary_df["food"]
+
+
 def get_most_common(diary_df: pd.DataFrame, top_n=10) -> pd.Series:
     """group diary by food and return bar chart of top n most freq logged foods
 
@@ -17,8 +33,8 @@ def get_most_common(diary_df: pd.DataFrame, top_n=10) -> pd.Series:
         Figure: px.bar figure
     """
     most_common = (
-        diary_df.groupby("food")
-        .count()["date"]
+        diary_df.groupby(get_food_keys(diary_df), observed=True)["date"]
+        .count()
         .drop("", errors="ignore")
         .sort_values(ascending=False)[0:top_n]
     )
@@ -50,6 +66,7 @@ def unpivot_food_macros(diary_df: pd.DataFrame) -> pd.DataFrame:
             "date",
         ]
     ]
+    diary_df_kcals = diary_df_kcals.assign(food=get_food_keys(diary_df))
     melted_df = diary_df_kcals.drop("calories_kcal", axis=1).melt(
         ["food", "date"]
     )
@@ -58,8 +75,11 @@ def unpivot_food_macros(diary_df: pd.DataFrame) -> pd.DataFrame:
     # add meal counter - i.e. how many meals it was eaten for
     melted_df["meals"] = 1
 
-    melted_df = melted_df.groupby(["food", "date", "variable"]).sum()
+    melted_df = melted_df.groupby(
+        ["food", "date", "variable"], observed=True
+    ).sum()
     melted_df = melted_df.reset_index()
+    melted_df["food"] = melted_df["food"].astype(str)
 
     return melted_df
 
@@ -129,59 +149,559 @@ def get_longest_streaks(diary_df: pd.DataFrame) -> Tuple[int, int]:
     Returns:
         Tuple[int, int]: Longest tracked streak, longest blank
     """
-    diary_df = diary_df.drop_duplicates(subset="date")
-    diary_df["tracked"] = True
-    min_date = diary_df["date"].min()
-    max_date = diary_df["date"].max()
-    all_dates = pd.Series(pd.date_range(min_date, max_date), name="all_dates")
+    # only the dates matter, other columns (e.g. categoricals) can't be
+    # filled in for untracked days
+    tracked_dates = pd.DatetimeIndex(pd.to_datetime(diary_df["date"]).unique())
+    if tracked_dates.empty:
+        return (0, 0)
+    all_dates = pd.date_range(tracked_dates.min(), tracked_dates.max())
+    streaks = StreakState.from_tracked(all_dates.isin(tracked_dates))
+    return (streaks.longest_tracked, streaks.longest_blank)
+
+
+def get_nutrient_columns(diary_df: pd.DataFrame) -> List[str]:
+    """numeric nutrient columns of a diary, excluding goals"""
+    return [
+        col
+        for col in diary_df.select_dtypes("number").columns
+        if not col.startswith("goal_")
+    ]
+
+
+def _top_k_rows(values: np.ndarray, top_k: int) -> Tuple[np.ndarray, ...]:
+    """row indices of the k largest values in each column, largest first
+
+    argpartition finds the top k in linear time so only k values per column
+    are sorted.
+    """
+    top_k = min(top_k, len(values))
+    top_idx = np.argpartition(-values, top_k - 1, axis=0)[:top_k]
+    top_values = np.take_along_axis(values, top_idx, axis=0)
+    order = np.argsort(-top_values, axis=0, kind="stable")
+    return np.take_along_axis(top_idx, order, axis=0), np.take_along_axis(
+        top_values, order, axis=0
+    )
+
+
+def get_top_sources(
+    diary_df: pd.DataFrame,
+    nutrients: Optional[Iterable[str]] = None,
+    top_k: int = 1,
+    period: Optional[str] = None,
+) -> pd.DataFrame:
+    """top k foods by total amount of each nutrient
+
+    Args:
+        diary_df (pd.DataFrame): diary with food, date and nutrient columns
+        nutrients (Optional[Iterable[str]]): nutrient columns to rank foods
+        by, defaults to every nutrient column in the diary. Columns the
+        diary doesn't have are skipped
+        top_k (int): number of foods to return for each nutrient
+        period (Optional[str]): pandas period alias (e.g. "M") to rank
+        foods within each period instead of over the whole diary
+
+    Returns:
+        pd.DataFrame: rows of [period,] nutrient, rank, food, amount. Foods
+        with none of a nutrient aren't ranked for it
+    """
+    if nutrients is None:
+        nutrients = get_nutrient_columns(diary_df)
+    nutrients = [col for col in nutrients if col in diary_df.columns]
+    diary_df = diary_df[diary_df["food"] != ""]
+
+    group_keys = [get_food_keys(diary_df)]
+    if period is not None:
+        diary_df = diary_df.assign(
+            period=pd.to_datetime(diary_df["date"]).dt.to_period(period)
+        )
+        group_keys.insert(0, "period")
+    food_totals = diary_df.groupby(group_keys, observed=True)[nutrients].sum()
+
+    if period is None:
+        period_totals = [(None, food_totals)]
+    else:
+        period_totals = food_totals.groupby(level="period")
+
+    top_sources = []
+    for period_key, totals in period_totals:
+        if totals.empty or not nutrients:
+            continue
+        foods = totals.index.get_level_values("food")
+        top_idx, top_values = _top_k_rows(totals.to_numpy(dtype=float), top_k)
+        num_ranks = len(top_idx)
+        # ravel column by column so rows are grouped by nutrient
+        period_sources = pd.DataFrame(
+            {
+                "nutrient": np.repeat(nutrients, num_ranks),
+                "rank": np.tile(np.arange(1, num_ranks + 1), len(nutrients)),
+                "food": foods[top_idx.ravel(order="F")],
+                "amount": top_values.ravel(order="F"),
+            }
+        )
+        if period is not None:
+            period_sources.insert(0, "period", period_key)
+        top_sources.append(period_sources)
+
+    columns = ["nutrient", "rank", "food", "amount"]
+    if period is not None:
+        columns.insert(0, "period")
+    if not top_sources:
+        return pd.DataFrame(columns=columns)
+    top_sources_df = pd.concat(top_sources, ignore_index=True)
+    return top_sources_df[top_sources_df["amount"] > 0].reset_index(drop=True)
+
+
+def get_meal_aggregates(
+    diary_df: pd.DataFrame, nutrients: Optional[Iterable[str]] = None
+) -> pd.DataFrame:
+    """entries and nutrient totals for each date, meal and food
+
+    Meal analyses are rollups of this one aggregate so the diary is only
+    grouped once.
+
+    Args:
+        diary_df (pd.DataFrame): diary with a meal column
+        nutrients (Optional[Iterable[str]]): nutrient columns to total,
+        defaults to every nutrient column in the diary
+
+    Returns:
+        pd.DataFrame: indexed by (date, meal, food) with an entries column
+        and a column per nutrient
+    """
+    if nutrients is None:
+        nutrients = get_nutrient_columns(diary_df)
+    nutrients = [col for col in nutrients if col in diary_df.columns]
+    diary_df = diary_df.assign(
+        date=pd.to_datetime(diary_df["date"]), entries=1
+    )
+    food_keys = get_food_keys(diary_df)
+    return diary_df.groupby(["date", "meal", food_keys], observed=True)[
+        ["entries", *nutrients]
+    ].sum()
+
+
+def get_meal_intake(
+    meal_aggregates: pd.DataFrame, nutrient: str = "calories_kcal"
+) -> pd.DataFrame:
+    """daily intake of a nutrient with a column per meal"""
+    return (
+        meal_aggregates[nutrient]
+        .groupby(level=["date", "meal"], observed=True)
+        .sum()
+        .unstack("meal", fill_value=0)
+    )
 
-    streak_df = diary_df.merge(
-        all_dates, how="outer", right_on="all_dates", left_on="date"
-    ).fillna(False)
 
-    streak_df = (
-        streak_df.set_index("all_dates", drop=True)
-        .drop("date", axis=1)
-        .sort_index()
+def get_meal_split(
+    meal_aggregates: pd.DataFrame, nutrient: str = "calories_kcal"
+) -> pd.Series:
+    """fraction of the total intake of a nutrient eaten at each meal"""
+    meal_totals = (
+        meal_aggregates[nutrient].groupby(level="meal", observed=True).sum()
     )
-    streak_df["start_of_streak"] = streak_df["tracked"].ne(
-        streak_df["tracked"].shift()
+    return meal_totals / meal_totals.sum()
+
+
+def get_meal_most_common(
+    meal_aggregates: pd.DataFrame, top_n: int = 5
+) -> pd.Series:
+    """top n most frequently logged foods at each meal
+
+    Returns:
+        pd.Series: number of entries indexed by (meal, food), most common
+        first within each meal
+    """
+    meal_counts = (
+        meal_aggregates["entries"]
+        .drop("", level="food", errors="ignore")
+        .groupby(level=["meal", "food"], observed=True)
+        .sum()
     )
-    streak_df["streak_id"] = streak_df["start_of_streak"].cumsum()
-    streak_df["streak_counter"] = streak_df.groupby("streak_id").cumcount() + 1
+    return (
+        meal_counts.sort_values(ascending=False, kind="stable")
+        .groupby(level="meal", observed=True)
+        .head(top_n)
+        .sort_index(level="meal", sort_remaining=False, kind="stable")
+    )
+
+
+# actual and goal columns of get_intake_goals output for each macro
+ADHERENCE_MACROS = {
+    "calories": ("calories_kcal", "goal_calories_kcal"),
+    "carbs": ("carbs_g", "goal_carbs_g"),
+    "fat": ("fat_g", "goal_fat_g"),
+    "protein": ("protein_g", "goal_protein_g"),
+}
+ADHERENCE_TOLERANCES = np.round(np.arange(0, 0.51, 0.01), 2)
+
+
+@dataclass(frozen=True)
+class AdherenceCurves:
+    """fraction of days within, over and under goal for each macro
+
+    within, over and under have shape (len(macros), len(tolerances)).
+    Days without a goal count towards none of them.
+    """
 
-    non_tracked_days = streak_df.loc[streak_df["tracked"] == False, :]  # noqa
-    tracked_days = streak_df.loc[streak_df["tracked"] == True, :]  # noqa
+    macros: Tuple[str, ...]
+    tolerances: np.ndarray
+    within: np.ndarray
+    over: np.ndarray
+    under: np.ndarray
 
-    longest_tracked_streak = tracked_days["streak_counter"].max()
-    longest_blank_streak = non_tracked_days["streak_counter"].max()
+    def to_frame(self) -> pd.DataFrame:
+        """long dataframe with a row per macro and tolerance"""
+        index = pd.MultiIndex.from_product(
+            [self.macros, self.tolerances], names=["macro", "tolerance"]
+        )
+        return pd.DataFrame(
+            {
+                "within": self.within.ravel(),
+                "over": self.over.ravel(),
+                "under": self.under.ravel(),
+            },
+            index=index,
+        ).reset_index()
+
+
+def get_adherence_curves(
+    intake_goals: pd.DataFrame,
+    tolerances: Iterable[float] = ADHERENCE_TOLERANCES,
+    macros: Iterable[str] = tuple(ADHERENCE_MACROS),
+) -> AdherenceCurves:
+    """adherence to goals for every macro and tolerance in one pass
+
+    A day is within tolerance if intake is strictly between
+    goal * (1 - tolerance) and goal * (1 + tolerance), over if it's at or
+    above the upper bound and under otherwise.
 
-    if pd.isnull(longest_blank_streak):
-        longest_blank_streak = 0
-    if pd.isnull(longest_tracked_streak):
-        longest_tracked_streak = 0
+    Args:
+        intake_goals (pd.DataFrame): output of get_intake_goals
+        tolerances (Iterable[float]): fractions of goal to allow either side
+        macros (Iterable[str]): keys of ADHERENCE_MACROS to include
 
-    return (longest_tracked_streak, longest_blank_streak)
+    Returns:
+        AdherenceCurves: fraction of days within/over/under goal
+    """
+    macros = tuple(macros)
+    tolerances = np.asarray(tolerances, dtype=float)
+    actual_cols = [ADHERENCE_MACROS[macro][0] for macro in macros]
+    goal_cols = [ADHERENCE_MACROS[macro][1] for macro in macros]
+
+    # (macros, days, 1) against (1, 1, tolerances)
+    actual = intake_goals[actual_cols].to_numpy(dtype=float).T[:, :, None]
+    goal = intake_goals[goal_cols].to_numpy(dtype=float).T[:, :, None]
+    upper = goal * (1 + tolerances)
+    lower = goal * (1 - tolerances)
+
+    over = actual >= upper
+    within = (actual < upper) & (actual > lower)
+    under = (actual <= lower) & ~over
+
+    num_days = max(len(intake_goals), 1)
+    return AdherenceCurves(
+        macros=macros,
+        tolerances=tolerances,
+        within=within.sum(axis=1) / num_days,
+        over=over.sum(axis=1) / num_days,
+        under=under.sum(axis=1) / num_days,
+    )
 
 
 def get_adherence_perc(
     intake_goals: pd.DataFrame, perc_tolerance: float = 0.1
 ) -> float:
+    """fraction of days within perc_tolerance of calorie goal"""
+    curves = get_adherence_curves(
+        intake_goals, tolerances=[perc_tolerance], macros=["calories"]
+    )
+    return float(curves.within[0, 0])
+
+
+def stratified_sample_days(
+    start_date: date, end_date: date, every: int = 7
+) -> pd.DatetimeIndex:
+    """pick one day from each block of `every` days in the range
+
+    The position within the block moves along each block so a weekly
+    sample covers every weekday rather than always landing on the start
+    date's weekday.
+    """
+    num_days = (end_date - start_date).days + 1
+    blocks = np.arange(0, num_days, every)
+    offsets = np.minimum(blocks + np.arange(len(blocks)) % every, num_days - 1)
+    return pd.Timestamp(start_date) + pd.to_timedelta(offsets, unit="D")
+
+
+@dataclass(frozen=True)
+class StreakState:
+    """tracked/blank runs of a contiguous span of days
+
+    States of adjacent spans combine with merge() so streaks over a range
+    can be built from cached spans without looking at every day again.
+    Blank runs only count towards longest_blank once they have a tracked
+    day on both sides, as in get_longest_streaks.
+    """
+
+    num_days: int = 0
+    lead_len: int = 0
+    lead_tracked: bool = False
+    trail_len: int = 0
+    trail_tracked: bool = False
+    longest_tracked: int = 0
+    longest_blank: int = 0
+    any_tracked: bool = False
+
+    @classmethod
+    def from_tracked(cls, tracked: np.ndarray) -> "StreakState":
+        """build state from a bool array of whether each day was tracked"""
+        tracked = np.asarray(tracked, dtype=bool)
+        num_days = len(tracked)
+        if num_days == 0:
+            return cls()
+        run_starts = np.r_[0, np.flatnonzero(tracked[1:] != tracked[:-1]) + 1]
+        run_lengths = np.diff(np.r_[run_starts, num_days])
+        run_tracked = tracked[run_starts]
+        # first and last runs aren't bounded by tracked days on both sides
+        inner_blank = ~run_tracked
+        inner_blank[[0, -1]] = False
+        return cls(
+            num_days=num_days,
+            lead_len=int(run_lengths[0]),
+            lead_tracked=bool(run_tracked[0]),
+            trail_len=int(run_lengths[-1]),
+            trail_tracked=bool(run_tracked[-1]),
+            longest_tracked=int(run_lengths[run_tracked].max(initial=0)),
+            longest_blank=int(run_lengths[inner_blank].max(initial=0)),
+            any_tracked=bool(run_tracked.any()),
+        )
+
+    def merge(self, other: "StreakState") -> "StreakState":
+        """combine with the state of the span directly after this one"""
+        if self.num_days == 0:
+            return other
+        if other.num_days == 0:
+            return self
+
+        longest_tracked = max(self.longest_tracked, other.longest_tracked)
+        if self.trail_tracked and other.lead_tracked:
+            longest_tracked = max(
+                longest_tracked, self.trail_len + other.lead_len
+            )
+
+        longest_blank = max(self.longest_blank, other.longest_blank)
+        if self.any_tracked and other.any_tracked:
+            # blank runs at the join are now bounded by tracked days
+            join_blank = (0 if self.trail_tracked else self.trail_len) + (
+                0 if other.lead_tracked else other.lead_len
+            )
+            longest_blank = max(longest_blank, join_blank)
+
+        # a span that's one run continues into the run next to it
+        self_one_run = self.lead_len == self.num_days
+        other_one_run = other.trail_len == other.num_days
+        lead_len = self.lead_len
+        if self_one_run and self.lead_tracked == other.lead_tracked:
+            lead_len += other.lead_len
+        trail_len = other.trail_len
+        if other_one_run and other.trail_tracked == self.trail_tracked:
+            trail_len += self.trail_len
+
+        return StreakState(
+            num_days=self.num_days + other.num_days,
+            lead_len=lead_len,
+            lead_tracked=self.lead_tracked,
+            trail_len=trail_len,
+            trail_tracked=other.trail_tracked,
+            longest_tracked=longest_tracked,
+            longest_blank=longest_blank,
+            any_tracked=self.any_tracked or other.any_tracked,
+        )
+
+
+@dataclass(frozen=True)
+class DiarySummary:
+    """mergeable summary of a contiguous range of diary days
+
+    Attributes:
+        start_date (date): first day summarised
+        end_date (date): last day summarised (inclusive)
+        daily (pd.DataFrame): get_intake_goals output for tracked days
+        food_counts (pd.Series): entries per (date, food)
+        streaks (StreakState): tracked/blank runs over the range
+    """
+
+    start_date: date
+    end_date: date
+    daily: pd.DataFrame
+    food_counts: pd.Series
+    streaks: StreakState
+
+    @property
+    def logged_days(self) -> int:
+        return len(self.daily)
+
+    @property
+    def total_days(self) -> int:
+        return (self.end_date - self.start_date).days + 1
+
+    def total_macros(self) -> Dict[str, int]:
+        return total_macros(self.daily)
+
+    def most_common(self, top_n=10) -> pd.Series:
+        """top n most frequently logged foods, like get_most_common"""
+        return (
+            self.food_counts.groupby(level="food")
+            .sum()
+            .drop("", errors="ignore")
+            .sort_values(ascending=False)[0:top_n]
+        )
+
+    def longest_streaks(self) -> Tuple[int, int]:
+        return (self.streaks.longest_tracked, self.streaks.longest_blank)
+
+    def adherence(self, perc_tolerance: float = 0.1) -> float:
+        return get_adherence_perc(self.daily, perc_tolerance=perc_tolerance)
+
+    def adherence_curves(
+        self, tolerances: Iterable[float] = ADHERENCE_TOLERANCES
+    ) -> AdherenceCurves:
+        return get_adherence_curves(self.daily, tolerances=tolerances)
+
+    def clip(self, start_date: date, end_date: date) -> "DiarySummary":
+        """summary of the days between start_date and end_date only"""
+        start_date = max(start_date, self.start_date)
+        end_date = min(end_date, self.end_date)
+        start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+        daily = self.daily.loc[start:end]
+        food_dates = self.food_counts.index.get_level_values("date")
+        return DiarySummary(
+            start_date=start_date,
+            end_date=end_date,
+            daily=daily,
+            food_counts=self.food_counts[
+                (food_dates >= start) & (food_dates <= end)
+            ],
+            streaks=StreakState.from_tracked(
+                pd.date_range(start, end).isin(daily.index)
+            ),
+        )
+
 
-    total_days = len(intake_goals)
+def summarise_diary(
+    diary_df: pd.DataFrame, start_date: date, end_date: date
+) -> DiarySummary:
+    """summarise the days of a diary between start_date and end_date
 
-    kcal_goals = intake_goals.loc[:, ["calories_kcal", "goal_calories_kcal"]]
-    kcal_goals["upper_kcal_tol"] = kcal_goals["goal_calories_kcal"] * (
-        1 + perc_tolerance
+    Args:
+        diary_df (pd.DataFrame): scraped diary, may cover more days than the
+        range being summarised
+        start_date (date): first day to summarise
+        end_date (date): last day to summarise (inclusive)
+
+    Returns:
+        DiarySummary: summary of the range
+    """
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    diary_dates = pd.to_datetime(diary_df["date"])
+    range_df = diary_df[(diary_dates >= start) & (diary_dates <= end)].copy()
+
+    daily = get_intake_goals(range_df)
+    food_counts = range_df.groupby(
+        ["date", get_food_keys(range_df)], observed=True
+    ).size()
+    food_counts.name = "entries"
+    tracked = pd.date_range(start, end).isin(daily.index)
+
+    return DiarySummary(
+        start_date=start_date,
+        end_date=end_date,
+        daily=daily,
+        food_counts=food_counts,
+        streaks=StreakState.from_tracked(tracked),
     )
-    kcal_goals["lower_kcal_tol"] = kcal_goals["goal_calories_kcal"] * (
-        1 - perc_tolerance
+
+
+def merge_summaries(summaries: Iterable[DiarySummary]) -> DiarySummary:
+    """combine summaries of adjacent date ranges into one
+
+    Raises:
+        ValueError: if the summaries overlap or leave gaps between them
+    """
+    summaries = sorted(summaries, key=lambda summary: summary.start_date)
+    if not summaries:
+        raise ValueError("No summaries to merge!")
+    streaks = summaries[0].streaks
+    for prev, summary in zip(summaries, summaries[1:]):
+        if summary.start_date != prev.end_date + timedelta(days=1):
+            raise ValueError(
+                f"Can't merge summary ending {prev.end_date} with summary "
+                f"starting {summary.start_date}, ranges must be adjacent"
+            )
+        streaks = streaks.merge(summary.streaks)
+
+    return DiarySummary(
+        start_date=summaries[0].start_date,
+        end_date=summaries[-1].end_date,
+        daily=pd.concat([summary.daily for summary in summaries]),
+        food_counts=pd.concat([summary.food_counts for summary in summaries]),
+        streaks=streaks,
     )
 
-    kcal_goals["within_tolerance"] = (
-        kcal_goals["calories_kcal"] < kcal_goals["upper_kcal_tol"]
-    ) & (kcal_goals["calories_kcal"] > kcal_goals["lower_kcal_tol"])
 
-    adhered_days = kcal_goals["within_tolerance"].sum()
+def extend_summary(
+    cached: Optional[DiarySummary],
+    diary_df: pd.DataFrame,
+    start_date: date,
+    end_date: date,
+    fresh_before: Optional[date] = None,
+) -> DiarySummary:
+    """summarise a range reusing a cached summary of overlapping days
+
+    Only days in the range that the cached summary doesn't cover are
+    summarised from diary_df, so widening or shifting a range costs time
+    proportional to the new days. The returned summary covers both the
+    cached days and the range, use DiarySummary.clip to get the range.
+
+    Args:
+        cached (Optional[DiarySummary]): previously computed summary
+        diary_df (pd.DataFrame): scraped diary covering at least the days
+        of the range that aren't cached
+        start_date (date): first day of the range
+        end_date (date): last day of the range (inclusive)
+        fresh_before (Optional[date]): cached days on or after this date
+        may have been edited since and are summarised again
 
-    return adhered_days / total_days
+    Returns:
+        DiarySummary: summary covering the cached days and the range
+    """
+    if cached is not None and fresh_before is not None:
+        if cached.start_date >= fresh_before:
+            cached = None
+        elif cached.end_date >= fresh_before:
+            cached = cached.clip(
+                cached.start_date, fresh_before - timedelta(days=1)
+            )
+
+    if cached is None:
+        return summarise_diary(diary_df, start_date, end_date)
+    starts_after = start_date > cached.end_date + timedelta(days=1)
+    ends_before = end_date < cached.start_date - timedelta(days=1)
+    if starts_after or ends_before:
+        # not next to the cached days, so nothing to reuse
+        return summarise_diary(diary_df, start_date, end_date)
+
+    summaries = [cached]
+    if start_date < cached.start_date:
+        summaries.append(
+            summarise_diary(
+                diary_df, start_date, cached.start_date - timedelta(days=1)
+            )
+        )
+    if end_date > cached.end_date:
+        summaries.append(
+            summarise_diary(
+                diary_df, cached.end_date + timedelta(days=1), end_date
+            )
+        )
+    return merge_summaries(summaries)
@@ -0,0 +1,326 @@
+"""
+Append-only archive of raw diary pages so the parser can be rerun over
+historical diaries without scraping myfitnesspal again.
+
+Each user gets a directory of segment files holding individually compressed
+pages back to back, plus an index.jsonl with one record per archived page::
+
+    <root>/<user>/index.jsonl
+    <root>/<user>/000001.seg
+    <root>/<user>/000002.seg
+
+Reprocess the archive with the current parser (e.g. after a fix to
+clean_mfp_extract) with::
+
+    python -m myfitnesspal.archive reprocess <root> <out_dir> [--user USER]
+"""
+import argparse
+import fcntl
+import gzip
+import json
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
+from datetime import date, datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from .diary_scraping import concat_diaries, parse_diary_page
+from .page_cache import hash_page
+
+try:
+    import zstandard
+except ImportError:  # optional dependency, fall back to gzip
+    zstandard = None
+
+INDEX_FILE = "index.jsonl"
+LOCK_FILE = ".lock"
+SEGMENT_SUFFIX = ".seg"
+MAX_SEGMENT_BYTES = 64 * 1024 * 1024
+
+
+def safe_user_dirname(user: str) -> str:
+    """directory name for a username that can't escape its parent"""
+    return re.sub(r"[^\w-]", "_", user)
+
+
+def _compress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+@dataclass(frozen=True)
+class ArchiveEntry:
+    """location of an archived page within a user's segment files"""
+
+    diary_date: str
+    segment: str
+    offset: int
+    length: int
+    codec: str
+    content_hash: str
+    archived_at: str
+
+
+class DiaryArchive:
+    """append-only, compressed archive of raw diary html"""
+
+    def __init__(
+        self,
+        root: str,
+        codec: Optional[str] = None,
+        max_segment_bytes: int = MAX_SEGMENT_BYTES,
+    ):
+        if codec is None:
+            codec = "zstd" if zstandard is not None else "gzip"
+        if codec == "zstd" and zstandard is None:
+            raise ValueError("zstd compression requires zstandard")
+        if codec not in ("zstd", "gzip"):
+            raise ValueError(f"unknown codec '{codec}'")
+        self.root = root
+        self.codec = codec
+        self.max_segment_bytes = max_segment_bytes
+        self._indexes: Dict[str, Dict[str, ArchiveEntry]] = {}
+        # bytes of each index file read into _indexes so far
+        self._index_offsets: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _user_dir(self, user: str) -> str:
+        # usernames end up in paths, don't let them escape the archive
+        return os.path.join(self.root, safe_user_dirname(user))
+
+    def users(self) -> List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            user
+            for user in os.listdir(self.root)
+            if os.path.isfile(os.path.join(self.root, user, INDEX_FILE))
+        )
+
+    def entries(self, user: str) -> Dict[str, ArchiveEntry]:
+        """latest archived entry for each date, keyed by iso date"""
+        with self._lock:
+            return dict(self._load_index(user))
+
+    def _load_index(self, user: str) -> Dict[str, ArchiveEntry]:
+        """index of a user, topped up with records appended since it was
+        last read, e.g. by other processes sharing the archive"""
+        index = self._indexes.setdefault(user, {})
+        offset = self._index_offsets.get(user, 0)
+        index_path = os.path.join(self._user_dir(user), INDEX_FILE)
+        try:
+            with open(index_path, "rb") as index_file:
+                index_file.seek(offset)
+                appended = index_file.read()
+        except FileNotFoundError:
+            return index
+        # a record still being written is read next time
+        complete = appended[: appended.rfind(b"\n") + 1]
+        for line in complete.splitlines():
+            if line.strip():
+                entry = ArchiveEntry(**json.loads(line))
+                # later records supersede earlier ones
+                index[entry.diary_date] = entry
+        self._index_offsets[user] = offset + len(complete)
+        return index
+
+    def _current_segment(self, user_dir: str, record_size: int) -> str:
+        segments = sorted(
+            name
+            for name in os.listdir(user_dir)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+        if segments:
+            latest = segments[-1]
+            size = os.path.getsize(os.path.join(user_dir, latest))
+            if size + record_size <= self.max_segment_bytes:
+                return latest
+            number = int(latest[: -len(SEGMENT_SUFFIX)]) + 1
+        else:
+            number = 1
+        return f"{number:06d}{SEGMENT_SUFFIX}"
+
+    def append(self, user: str, diary_date, html: str) -> bool:
+        """archive a page, returns False if it is identical to the latest
+        archived copy for that date"""
+        diary_date = pd.Timestamp(diary_date).date().isoformat()
+        content_hash = hash_page(html)
+        if self._is_latest(user, diary_date, content_hash):
+            return False
+        # compressed outside the lock so appends for other days don't wait
+        record = _compress(html.encode(), self.codec)
+        user_dir = self._user_dir(user)
+
+        os.makedirs(user_dir, exist_ok=True)
+        lock_path = os.path.join(user_dir, LOCK_FILE)
+        with self._lock, open(lock_path, "w") as lock_file:
+            # app processes can share the archive, the segment offset and
+            # index record must not interleave with their appends
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # another thread or process may have archived the page while
+            # compressing
+            index = self._load_index(user)
+            latest = index.get(diary_date)
+            if latest is not None and latest.content_hash == content_hash:
+                return False
+
+            segment = self._current_segment(user_dir, len(record))
+            with open(os.path.join(user_dir, segment), "ab") as seg_file:
+                offset = seg_file.seek(0, os.SEEK_END)
+                seg_file.write(record)
+
+            entry = ArchiveEntry(
+                diary_date=diary_date,
+                segment=segment,
+                offset=offset,
+                length=len(record),
+                codec=self.codec,
+                content_hash=content_hash,
+                archived_at=datetime.utcnow().isoformat(),
+            )
+            # index is written after the segment so a crash can't leave an
+            # index entry pointing at a missing record
+            index_path = os.path.join(user_dir, INDEX_FILE)
+            with open(index_path, "a") as index_file:
+                index_file.write(json.dumps(asdict(entry)) + "\n")
+            # read back by _load_index, which keeps the offset in step
+            self._load_index(user)
+        return True
+
+    def _is_latest(
+        self, user: str, diary_date: str, content_hash: str
+    ) -> bool:
+        with self._lock:
+            latest = self._load_index(user).get(diary_date)
+        return latest is not None and latest.content_hash == content_hash
+
+    def read(self, user: str, entry: ArchiveEntry) -> str:
+        path = os.path.join(self._user_dir(user), entry.segment)
+        with open(path, "rb") as seg_file:
+            seg_file.seek(entry.offset)
+            record = seg_file.read(entry.length)
+        return _decompress(record, entry.codec).decode()
+
+    def iter_pages(self, user: str) -> Iterator[Tuple[date, str]]:
+        """yield (date, html) for the latest copy of every archived date"""
+        for diary_date, entry in sorted(self.entries(user).items()):
+            yield date.fromisoformat(diary_date), self.read(user, entry)
+
+
+def _parse_archived(
+    root: str, user: str, entries: List[ArchiveEntry]
+) -> Tuple[Optional[pd.DataFrame], int]:
+    """parse a chunk of archived pages, returns diary and num of failures"""
+    archive = DiaryArchive(root)
+    diaries = []
+    failed = 0
+    for entry in entries:
+        html = archive.read(user, entry)
+        try:
+            diaries.append(
+                parse_diary_page(html, date.fromisoformat(entry.diary_date))
+            )
+        except ValueError:
+            failed += 1
+    if not diaries:
+        return None, failed
+    return concat_diaries(diaries), failed
+
+
+def reprocess_archive(
+    root: str,
+    out_dir: str,
+    users: Optional[List[str]] = None,
+    workers: Optional[int] = None,
+    chunk_size: int = 31,
+) -> Dict[str, Tuple[int, int]]:
+    """rerun the parser over archived pages in parallel and write one
+    parquet file of the parsed diary per user
+
+    Returns:
+        Dict[str, Tuple[int, int]]: user -> (pages parsed, pages failed)
+    """
+    archive = DiaryArchive(root)
+    users = users or archive.users()
+    os.makedirs(out_dir, exist_ok=True)
+
+    # only users with chunks still parsing are held in memory
+    results: Dict[str, List[Tuple[str, pd.DataFrame]]] = {}
+    chunks_left: Dict[str, int] = {}
+    stats = {user: (0, 0) for user in users}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for user in users:
+            entries = [
+                entry for _, entry in sorted(archive.entries(user).items())
+            ]
+            for idx in range(0, len(entries), chunk_size):
+                chunk = entries[idx : idx + chunk_size]
+                future = pool.submit(_parse_archived, root, user, chunk)
+                futures[future] = (user, chunk[0].diary_date, len(chunk))
+                chunks_left[user] = chunks_left.get(user, 0) + 1
+
+        for future in as_completed(futures):
+            user, first_date, num_pages = futures.pop(future)
+            diary_df, failed = future.result()
+            parsed, total_failed = stats[user]
+            stats[user] = (parsed + num_pages - failed, total_failed + failed)
+            if diary_df is not None:
+                results.setdefault(user, []).append((first_date, diary_df))
+
+            chunks_left[user] -= 1
+            if chunks_left[user] == 0 and user in results:
+                _write_user_parquet(out_dir, user, results.pop(user))
+    return stats
+
+
+def _write_user_parquet(
+    out_dir: str, user: str, chunks: List[Tuple[str, pd.DataFrame]]
+) -> None:
+    diary_df = concat_diaries(
+        df for _, df in sorted(chunks, key=lambda chunk: chunk[0])
+    )
+    diary_df.to_parquet(os.path.join(out_dir, f"{user}.parquet"))
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m myfitnesspal.archive",
+        description="Raw diary page archive tools",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    reprocess = subparsers.add_parser(
+        "reprocess", help="rerun the diary parser over archived pages"
+    )
+    reprocess.add_argument("root", help="archive directory")
+    reprocess.add_argument("out_dir", help="directory to write parquet to")
+    reprocess.add_argument(
+        "--user",
+        action="append",
+        dest="users",
+        help="only reprocess this user (can be repeated)",
+    )
+    reprocess.add_argument("--workers", type=int, default=None)
+    reprocess.add_argument("--chunk-size", type=int, default=31)
+    args = parser.parse_args(argv)
+
+    stats = reprocess_archive(
+        args.root, args.out_dir, args.users, args.workers, args.chunk_size
+    )
+    for user, (parsed, failed) in sorted(stats.items()):
+        print(f"{user}: parsed {parsed} pages ({failed} failed)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,56 @@
 import asyncio
 import json
+import os
 from datetime import date, timedelta
-from typing import Generator, Optional
+from typing import TYPE_CHECKING, Generator, Iterable, NamedTuple, Optional
 
 import pandas as pd
-import requests
-from httpx import AsyncClient
-from requests import Session
+from httpx import AsyncClient, Response, TransportError
 
+from .instrumentation import (
+    record_cache_hit,
+    record_fetch,
+    record_retry,
+    run_in_thread,
+    span,
+)
+from .page_cache import CachedPage, DiaryPageCache, hash_page
+from .single_flight import SingleFlight
 
-def login_mfp(username: str, password: str) -> Session:
+if TYPE_CHECKING:
+    from requests import Session
+
+    from .archive import DiaryArchive
+
+# overridable to point the scraper at a local stand-in, e.g. for load tests
+MFP_BASE_URL = os.environ.get(
+    "MFP_BASE_URL", "https://www.myfitnesspal.com"
+).rstrip("/")
+MAX_RETRIES = 2
+RETRY_BACKOFF_SECONDS = 0.5
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+# shares in-flight fetch/parse of a (user, date) between sessions
+diary_flights = SingleFlight("diary single flight")
+
+
+class ScrapedPage(NamedTuple):
+    """raw diary page fetched from myfitnesspal
+
+    html is None when the server answered a conditional request with
+    304 Not Modified, i.e. cached (the copy the request's validators came
+    from) is still current.
+    """
+
+    diary_date: date
+    html: Optional[str]
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    cached: Optional[CachedPage] = None
+
+
+def login_mfp(username: str, password: str) -> "Session":
     """login user to myfitnesspal
 
     Args:
@@ -23,21 +64,24 @@ def login_mfp(username: str, password: str) -> Session:
     Returns:
         Session: logged in user session
     """
+    # requests is only needed for the sync scraper
+    import requests
+
     # login to myfitness pal
     session = requests.session()
 
     # grab csrf token
-    csrf_res = session.get("https://www.myfitnesspal.com/api/auth/csrf")
+    csrf_res = session.get(f"{MFP_BASE_URL}/api/auth/csrf")
     csrf_token = json.loads(csrf_res.text)["csrfToken"]
 
     # send credentials
     session.post(
-        "https://www.myfitnesspal.com/api/auth/callback/credentials?",
+        f"{MFP_BASE_URL}/api/auth/callback/credentials?",
         data={
             "username": username,
             "password": password,
             "csrfToken": csrf_token,
-            "callbackUrl": "https://www.myfitnesspal.com/account/login",
+            "callbackUrl": f"{MFP_BASE_URL}/account/login",
             "redirect": "false",
             "json": "true",
         },
@@ -45,10 +89,10 @@ def login_mfp(username: str, password: str) -> Session:
     )
 
     # get session
-    session.get("https://www.myfitnesspal.com/api/auth/session")
+    session.get(f"{MFP_BASE_URL}/api/auth/session")
 
     # check if login successful
-    res = session.get("https://www.myfitnesspal.com/")
+    res = session.get(f"{MFP_BASE_URL}/")
 
     if res.text.find("/account/logout") > 0:
         return session
@@ -62,14 +106,24 @@ def clean_mfp_extract(df: pd.DataFrame) -> pd.DataFrame:
         "food",
         *[str(col).lower().replace("  ", "_") for col in df.iloc[0][1:]],
     ]  # type: ignore
+    # the header row is titled with the first meal
+    first_meal = df.iloc[0, 0]
     df.drop(0, inplace=True)
 
     # remove junk rows with no food data
     non_food_row_idx = df[
         df["food"].apply(lambda x: "quick tools" in str(x).lower())
     ].index
-    meal_title_row_idx = df[df["food"].apply(lambda x: len(str(x)) == 1)].index
-    non_food_row_idx = non_food_row_idx.append(meal_title_row_idx)
+    spacer_row_idx = df[df["food"].apply(lambda x: len(str(x)) == 1)].index
+    non_food_row_idx = non_food_row_idx.append(spacer_row_idx)
+
+    # meal title rows (e.g. "Lunch") name the meal of the foods below them
+    # and have no nutrition data of their own
+    has_name = df["food"].notna() & ~df.index.isin(non_food_row_idx)
+    no_nutrition = pd.to_numeric(df.iloc[:, 1], errors="coerce").isna()
+    is_meal_title = has_name & no_nutrition
+    meals = df["food"].where(is_meal_title).ffill().fillna(first_meal)
+    non_food_row_idx = non_food_row_idx.append(df.index[is_meal_title])
     df.drop(non_food_row_idx, inplace=True)
     df.dropna(axis=(0), how="all", inplace=True)
     df.dropna(axis=(1), how="all", inplace=True)
@@ -91,7 +145,9 @@ def clean_mfp_extract(df: pd.DataFrame) -> pd.DataFrame:
     new_df.fillna(method="bfill", inplace=True)
 
     # drop last 5 rows - non food items
-    cleaned_df = new_df.drop(new_df.index[-5:]).reset_index(drop=True)
+    cleaned_df = new_df.drop(new_df.index[-5:])
+    cleaned_df["meal"] = meals.reindex(cleaned_df.index)
+    cleaned_df.reset_index(drop=True, inplace=True)
     macro_cols = [
         "carbs_g",
         "fat_g",
@@ -110,18 +166,55 @@ def clean_mfp_extract(df: pd.DataFrame) -> pd.DataFrame:
     ]
     cleaned_df[numeric_cols] = cleaned_df[numeric_cols].apply(pd.to_numeric)
 
+    # split "food name, qty" entries - qty has to be taken before the food
+    # column is overwritten
+    cleaned_df["qty"] = cleaned_df["food"].apply(
+        lambda x: "".join(str(x).split(",")[-1]).strip()
+    )
     cleaned_df["food"] = cleaned_df["food"].apply(
         lambda x: "".join(str(x).split(",")[:-1])
     )
-    cleaned_df["qty"] = cleaned_df["food"].apply(
-        lambda x: "".join(str(x).split(",")[-1])
-    )
 
     return cleaned_df
 
 
+def parse_diary_page(html: str, diary_date: date) -> pd.DataFrame:
+    """parse the html of a diary page into a cleaned dataframe
+
+    Args:
+        html (str): html of the diary page
+        diary_date (date): date of the diary, added as a "date" column
+
+    Raises:
+        ValueError: if no diary table is found in the html
+
+    Returns:
+        pd.DataFrame: cleaned food diary for the date
+    """
+    try:
+        with span("read_html"):
+            html_df = pd.read_html(html, flavor="lxml")[0]
+        with span("clean_mfp_extract"):
+            clean_df = clean_mfp_extract(html_df)
+        clean_df["date"] = diary_date
+        return clean_df
+    except ValueError as error:
+        raise ValueError(f"No diary table found for {diary_date}!") from error
+
+
+def concat_diaries(diaries: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    """concat parsed diary days, storing meal names as a categorical"""
+    diary_df = pd.concat(diaries, axis=0, join="outer")
+    if "meal" in diary_df.columns:
+        # keep meals in diary order (breakfast, lunch...) not alphabetical
+        diary_df["meal"] = pd.Categorical(
+            diary_df["meal"], categories=diary_df["meal"].dropna().unique()
+        )
+    return diary_df
+
+
 def extract_diary(
-    logged_in_mfp_session: Session,
+    logged_in_mfp_session: "Session",
     diary_date: date,
     user: Optional[str] = None,
 ) -> pd.DataFrame:
@@ -144,18 +237,12 @@ def extract_diary(
     date_param = f"date={diary_date.isoformat()}"
 
     if user:
-        url = f"https://www.myfitnesspal.com/food/diary/{user}?{date_param}"
+        url = f"{MFP_BASE_URL}/food/diary/{user}?{date_param}"
     else:
-        url = f"https://www.myfitnesspal.com/food/diary?{date_param}"
+        url = f"{MFP_BASE_URL}/food/diary?{date_param}"
 
     res = logged_in_mfp_session.get(url)
-    try:
-        html_df = pd.read_html(res.text, flavor="lxml")[0]
-        clean_df = clean_mfp_extract(html_df)
-        clean_df["date"] = diary_date
-        return clean_df
-    except ValueError as error:
-        raise ValueError("No diary table found for {diary_date}!") from error
+    return parse_diary_page(res.text, diary_date)
 
 
 def get_diary_data(
@@ -166,6 +253,8 @@ def get_diary_data(
     pwd: Optional[str] = None,
 ) -> Generator[pd.DataFrame, None, None]:
 
+    from requests import Session
+
     if public:
         mfp_session = Session()
     else:
@@ -183,31 +272,203 @@ def get_diary_data(
         yield diary_df
 
 
-async def async_scrape_diary_data(user, date, client):
-    url = f"https://www.myfitnesspal.com/food/diary/{user}?date={date}"
-    res = await client.get(url)
-    return date, res.text
+async def _get_with_retries(
+    client: AsyncClient, url: str, headers: dict
+) -> Response:
+    """GET url, retrying transport errors and rate limit/server errors"""
+    for attempt in range(MAX_RETRIES + 1):
+        last_attempt = attempt == MAX_RETRIES
+        try:
+            res = await client.get(url, headers=headers)
+        except TransportError:
+            if last_attempt:
+                raise
+        else:
+            record_fetch(res.status_code, len(res.content))
+            if res.status_code not in RETRY_STATUS_CODES or last_attempt:
+                return res
+        record_retry()
+        await asyncio.sleep(RETRY_BACKOFF_SECONDS * 2**attempt)
+    raise AssertionError("unreachable")
+
+
+async def async_scrape_diary_data(
+    user: str,
+    date: date,
+    client: AsyncClient,
+    page_cache: Optional[DiaryPageCache] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+) -> ScrapedPage:
+    url = f"{MFP_BASE_URL}/food/diary/{user}?date={date}"
+    # revalidate pages we've already parsed instead of downloading them again
+    cached = page_cache.get(user, date) if page_cache else None
+    headers = cached.conditional_headers() if cached else {}
+    if semaphore is None:
+        with span("fetch"):
+            res = await _get_with_retries(client, url, headers)
+    else:
+        async with semaphore:
+            with span("fetch"):
+                res = await _get_with_retries(client, url, headers)
+    if res.status_code == 304:
+        # the cache entry may be evicted before parsing, keep hold of it
+        return ScrapedPage(date, None, cached=cached)
+    if res.status_code >= 400:
+        # error pages aren't diaries, don't hand them to the parser
+        raise ValueError(
+            f"myfitnesspal returned {res.status_code} for {user} on "
+            f"{date:%Y-%m-%d}"
+        )
+    return ScrapedPage(
+        date,
+        res.text,
+        res.headers.get("etag"),
+        res.headers.get("last-modified"),
+    )
+
+
+async def async_scrape_diaries(
+    start_date: date,
+    end_date: date,
+    user: str,
+    page_cache: Optional[DiaryPageCache] = None,
+    client: Optional[AsyncClient] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+):
+    """scrape every diary page in a date range concurrently
 
+    Args:
+        start_date (date): first date to scrape
+        end_date (date): last date to scrape (inclusive)
+        user (str): myfitnesspal username
+        page_cache (Optional[DiaryPageCache]): send conditional requests for
+        pages in this cache
+        client (Optional[AsyncClient]): client to reuse, a new one is
+        created if not passed
+        semaphore (Optional[asyncio.Semaphore]): limits requests in flight,
+        share one between calls to bound concurrency across users
 
-async def async_scrape_diaries(start_date: date, end_date: date, user: str):
-    async_client = AsyncClient()
+    Returns:
+        List[ScrapedPage]: scraped page for each date in the range
+    """
+    async_client = client or AsyncClient()
     coroutines = []
     for diary_date in pd.date_range(start_date, end_date):
         coroutines.append(
-            async_scrape_diary_data(user, diary_date, async_client)
+            async_scrape_diary_data(
+                user, diary_date, async_client, page_cache, semaphore
+            )
         )
     extracted_diaries = await asyncio.gather(*coroutines)
     return extracted_diaries
 
 
-def async_get_diary_data(extracted_diaries):
-    for diary_date, diary in extracted_diaries:
-        try:
-            html_df = pd.read_html(diary, flavor="lxml")[0]
-            clean_df = clean_mfp_extract(html_df)
-            clean_df["date"] = diary_date
-            yield clean_df
-        except ValueError as error:
+def load_scraped_page(
+    page: ScrapedPage,
+    user: Optional[str] = None,
+    page_cache: Optional[DiaryPageCache] = None,
+) -> pd.DataFrame:
+    """parse a scraped page, reusing the cached dataframe if it's unchanged
+
+    Args:
+        page (ScrapedPage): page returned by async_scrape_diary_data
+        user (Optional[str]): user the page belongs to, used as cache key
+        page_cache (Optional[DiaryPageCache]): cache of parsed pages
+
+    Raises:
+        ValueError: if no diary table is found in the page
+
+    Returns:
+        pd.DataFrame: cleaned food diary for the page's date
+    """
+    if page_cache is None or user is None:
+        return parse_diary_page(page.html, page.diary_date)
+
+    if page.html is None:
+        # 304 not modified
+        if page.cached is None:
             raise ValueError(
-                "No diary table found for {diary_date}!"
-            ) from error
+                f"Diary for {page.diary_date} not modified but not cached!"
+            )
+        record_cache_hit("not modified")
+        return page.cached.diary_df.copy()
+
+    cached = page_cache.get(user, page.diary_date)
+
+    content_hash = hash_page(page.html)
+    if cached is not None and cached.content_hash == content_hash:
+        # server doesn't support conditional requests but the page is the
+        # same, keep the latest validators and skip parsing
+        page_cache.put(
+            user,
+            page.diary_date,
+            CachedPage(
+                content_hash, cached.diary_df, page.etag, page.last_modified
+            ),
+        )
+        record_cache_hit("unchanged page")
+        return cached.diary_df.copy()
+
+    diary_df = parse_diary_page(page.html, page.diary_date)
+    page_cache.put(
+        user,
+        page.diary_date,
+        CachedPage(
+            content_hash, diary_df.copy(), page.etag, page.last_modified
+        ),
+    )
+    return diary_df
+
+
+def async_get_diary_data(
+    extracted_diaries: Iterable[ScrapedPage],
+    user: Optional[str] = None,
+    page_cache: Optional[DiaryPageCache] = None,
+) -> Generator[pd.DataFrame, None, None]:
+    for page in extracted_diaries:
+        yield load_scraped_page(page, user, page_cache)
+
+
+async def async_load_diary_day(
+    user: str,
+    diary_date: date,
+    client: AsyncClient,
+    page_cache: Optional[DiaryPageCache] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    archive: Optional["DiaryArchive"] = None,
+) -> pd.DataFrame:
+    """fetch and parse the diary for one day
+
+    Concurrent calls for the same user and date (e.g. from other sessions)
+    await the same fetch/parse instead of repeating it, so the returned
+    dataframe is shared and must not be modified in place.
+
+    Args:
+        user (str): myfitnesspal username
+        diary_date (date): date to load
+        client (AsyncClient): client used for the request
+        page_cache (Optional[DiaryPageCache]): cache of parsed pages
+        semaphore (Optional[asyncio.Semaphore]): limits requests in flight
+        archive (Optional[DiaryArchive]): archive for downloaded pages
+
+    Raises:
+        ValueError: if no diary table is found in the page
+
+    Returns:
+        pd.DataFrame: cleaned food diary for the date
+    """
+
+    async def fetch_and_parse() -> pd.DataFrame:
+        page = await async_scrape_diary_data(
+            user, diary_date, client, page_cache, semaphore
+        )
+        # every session shares the scrape loop, so compressing and parsing
+        # run in threads and only the request itself runs on the loop
+        if archive is not None and page.html is not None:
+            await run_in_thread(
+                archive.append, user, page.diary_date, page.html
+            )
+        return await run_in_thread(load_scraped_page, page, user, page_cache)
+
+    key = (user, pd.Timestamp(diary_date).date())
+    return await diary_flights.do(key, fetch_and_parse)
@@ -0,0 +1,237 @@
+"""
+Diary store shared by every app worker process on a host.
+
+Parsed diaries are written once as uncompressed Arrow IPC (feather v2)
+files and memory-mapped by whichever worker reads them, so a diary scraped
+by one process is served to the others without scraping or parsing it
+again. A sqlite index maps (user, start date, end date) to files::
+
+    <root>/index.sqlite
+    <root>/<uuid>.arrow
+
+Reads are zero copy up to the arrow table: slicing a stored diary down to
+a smaller date range only adjusts offsets into the mapped file, and the
+page cache holds a single copy of each file however many workers read it.
+Converting to pandas still copies string and categorical columns.
+
+Files are evicted least recently read first once the store grows past its
+size limit. Diaries that covered the last couple of days when they were
+stored, which may still have been edited on myfitnesspal since, are only
+served for recent_ttl seconds.
+"""
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import closing
+from datetime import date, timedelta
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from .instrumentation import record_cache_hit
+
+INDEX_FILE = "index.sqlite"
+STORE_SUFFIX = ".arrow"
+MAX_STORE_BYTES = 1024 * 1024 * 1024
+RECENT_TTL_SECONDS = 10 * 60
+# diaries for days this recent may still change
+RECENT_DAYS = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS diaries (
+    user TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_read REAL NOT NULL,
+    PRIMARY KEY (user, start_date, end_date)
+)
+"""
+
+
+class SharedDiaryStore:
+    """size bounded store of parsed diaries shared between processes"""
+
+    def __init__(
+        self,
+        root: str,
+        max_bytes: int = MAX_STORE_BYTES,
+        recent_ttl: float = RECENT_TTL_SECONDS,
+    ):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.recent_ttl = recent_ttl
+        os.makedirs(root, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # a connection per call, sqlite connections can't be shared between
+        # threads and each worker process has its own anyway
+        conn = sqlite3.connect(os.path.join(self.root, INDEX_FILE), timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def get(
+        self, user: str, start_date: date, end_date: date
+    ) -> Optional[pd.DataFrame]:
+        """diary for a date range from any stored diary covering it"""
+        table = self.get_table(user, start_date, end_date)
+        if table is None:
+            return None
+        return table.to_pandas(split_blocks=True)
+
+    def get_table(
+        self, user: str, start_date: date, end_date: date
+    ) -> Optional[pa.Table]:
+        """memory mapped arrow table of the diary for a date range"""
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            # a diary that included days still open to edits when it was
+            # scraped is only trusted for recent_ttl, however old those
+            # days are by now
+            row = conn.execute(
+                "SELECT path, start_date, end_date FROM diaries "
+                "WHERE user = ? AND start_date <= ? AND end_date >= ? "
+                "AND (created_at >= ? OR end_date < "
+                "date(created_at, 'unixepoch', 'localtime', ?)) "
+                "ORDER BY julianday(end_date) - julianday(start_date) LIMIT 1",
+                (
+                    user,
+                    start_date.isoformat(),
+                    end_date.isoformat(),
+                    now - self.recent_ttl,
+                    f"-{RECENT_DAYS} days",
+                ),
+            ).fetchone()
+            if row is None:
+                return None
+            path, stored_start, stored_end = row
+            conn.execute(
+                "UPDATE diaries SET last_read = ? WHERE path = ?", (now, path)
+            )
+
+        try:
+            table = _read_table(os.path.join(self.root, path))
+        except FileNotFoundError:
+            # evicted by another worker since the lookup
+            return None
+        record_cache_hit("shared store")
+        if (stored_start, stored_end) == (
+            start_date.isoformat(),
+            end_date.isoformat(),
+        ):
+            return table
+        return _slice_dates(table, start_date, end_date)
+
+    def put(
+        self,
+        user: str,
+        start_date: date,
+        end_date: date,
+        diary_df: pd.DataFrame,
+    ) -> None:
+        """store the diary for a date range, replacing any stored copy"""
+        table = pa.Table.from_pandas(diary_df, preserve_index=True)
+        path = f"{uuid.uuid4().hex}{STORE_SUFFIX}"
+        full_path = os.path.join(self.root, path)
+        # write then rename so readers never map a partial file
+        tmp_path = f"{full_path}.{os.getpid()}.tmp"
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, full_path)
+
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            replaced = conn.execute(
+                "SELECT path FROM diaries "
+                "WHERE user = ? AND start_date = ? AND end_date = ?",
+                (user, start_date.isoformat(), end_date.isoformat()),
+            ).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO diaries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    user,
+                    start_date.isoformat(),
+                    end_date.isoformat(),
+                    path,
+                    os.path.getsize(full_path),
+                    now,
+                    now,
+                ),
+            )
+            evicted = self._evict(conn)
+        if replaced is not None:
+            evicted.append(replaced[0])
+        # unlinking is safe while other workers still have the file mapped
+        for evicted_path in evicted:
+            _remove(os.path.join(self.root, evicted_path))
+
+    def _evict(self, conn: sqlite3.Connection) -> List[str]:
+        """drop least recently read diaries until under max_bytes"""
+        (total,) = conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM diaries"
+        ).fetchone()
+        evicted: List[str] = []
+        if total <= self.max_bytes:
+            return evicted
+        for path, size in conn.execute(
+            "SELECT path, size FROM diaries ORDER BY last_read"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            evicted.append(path)
+            total -= size
+        conn.executemany(
+            "DELETE FROM diaries WHERE path = ?", [(path,) for path in evicted]
+        )
+        return evicted
+
+    def size(self) -> int:
+        """total bytes of stored diaries"""
+        with closing(self._connect()) as conn:
+            (total,) = conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM diaries"
+            ).fetchone()
+        return total
+
+    def __len__(self) -> int:
+        with closing(self._connect()) as conn:
+            (count,) = conn.execute("SELECT COUNT(*) FROM diaries").fetchone()
+        return count
+
+
+def _read_table(path: str) -> pa.Table:
+    # the table's buffers point into the mapping rather than being read
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+
+def _slice_dates(
+    table: pa.Table, start_date: date, end_date: date
+) -> pa.Table:
+    """rows of a diary table between two dates, without copying
+
+    Diaries are stored in date order so the range is a contiguous slice.
+    The date column can be date32 (dates) or timestamp (pandas datetimes),
+    numpy compares datetime64 values of either unit.
+    """
+    dates = table.column("date").to_numpy()
+    start = np.searchsorted(dates, np.datetime64(start_date, "D"))
+    # timestamps during the last day are before the start of the next
+    end = np.searchsorted(
+        dates, np.datetime64(end_date + timedelta(days=1), "D")
+    )
+    return table.slice(start, end - start)
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
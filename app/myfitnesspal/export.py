@@ -0,0 +1,172 @@
+"""
+Streaming export of diaries as CSV, Parquet or NDJSON
+
+Exports are generated a chunk of rows at a time, so writing a multi-year
+diary never holds more than one chunk's text (or one parquet row group)
+on top of the dataframe itself::
+
+    with open("diary.csv", "wb") as out:
+        for chunk in iter_export(diary_df, "csv"):
+            out.write(chunk)
+"""
+import io
+import tempfile
+from typing import IO, Callable, Dict, Iterator, NamedTuple
+
+import pandas as pd
+
+CHUNK_ROWS = 10_000
+
+
+class ExportFormat(NamedTuple):
+    extension: str
+    mime: str
+
+
+EXPORT_FORMATS: Dict[str, ExportFormat] = {
+    "csv": ExportFormat(".csv", "text/csv"),
+    "parquet": ExportFormat(".parquet", "application/vnd.apache.parquet"),
+    "ndjson": ExportFormat(".ndjson", "application/x-ndjson"),
+}
+
+
+def _chunks(df: pd.DataFrame, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start : start + chunk_rows]
+
+
+def iter_csv(
+    df: pd.DataFrame, chunk_rows: int = CHUNK_ROWS, index: bool = False
+) -> Iterator[bytes]:
+    """csv of df in chunks, the header is only written with the first"""
+    yield df.iloc[:0].to_csv(index=index).encode()
+    for chunk in _chunks(df, chunk_rows):
+        yield chunk.to_csv(index=index, header=False).encode()
+
+
+def iter_ndjson(
+    df: pd.DataFrame, chunk_rows: int = CHUNK_ROWS, index: bool = False
+) -> Iterator[bytes]:
+    """one json object per row, dates in iso format"""
+    if index:
+        df = df.reset_index()
+    for chunk in _chunks(df, chunk_rows):
+        text = chunk.to_json(orient="records", lines=True, date_format="iso")
+        # pandas only separates lines, every chunk has to end with one
+        yield (text.rstrip("\n") + "\n").encode()
+
+
+class _DrainBuffer(io.RawIOBase):
+    """write only file that hands back what was written since last
+    drained, so parquet can be streamed without seeking"""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def iter_parquet(
+    df: pd.DataFrame, chunk_rows: int = CHUNK_ROWS, index: bool = False
+) -> Iterator[bytes]:
+    """parquet file written one row group per chunk"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # one schema for every row group, inferred chunk by chunk a column
+    # that's all missing in one chunk would get a different type
+    schema = pa.Schema.from_pandas(df, preserve_index=index)
+    sink = _DrainBuffer()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for chunk in _chunks(df, chunk_rows):
+            writer.write_table(
+                pa.Table.from_pandas(
+                    chunk, schema=schema, preserve_index=index
+                )
+            )
+            yield sink.drain()
+    # the footer is written on close
+    yield sink.drain()
+
+
+_EXPORTERS: Dict[str, Callable[..., Iterator[bytes]]] = {
+    "csv": iter_csv,
+    "parquet": iter_parquet,
+    "ndjson": iter_ndjson,
+}
+
+
+def iter_export(
+    df: pd.DataFrame,
+    export_format: str,
+    chunk_rows: int = CHUNK_ROWS,
+    index: bool = False,
+) -> Iterator[bytes]:
+    """stream df in one of EXPORT_FORMATS
+
+    Args:
+        df (pd.DataFrame): diary, or per-day summary with index=True
+        export_format (str): "csv", "parquet" or "ndjson"
+        chunk_rows (int): rows converted at a time
+        index (bool): include the index, e.g. the date of get_intake_goals
+
+    Returns:
+        Iterator[bytes]: consecutive pieces of the file
+    """
+    if export_format not in _EXPORTERS:
+        raise ValueError(f"unknown export format '{export_format}'")
+    return _EXPORTERS[export_format](df, chunk_rows, index)
+
+
+def write_export(
+    df: pd.DataFrame,
+    path: str,
+    export_format: str,
+    chunk_rows: int = CHUNK_ROWS,
+    index: bool = False,
+) -> int:
+    """stream df to a file, returns the number of bytes written"""
+    written = 0
+    with open(path, "wb") as out_file:
+        for chunk in iter_export(df, export_format, chunk_rows, index):
+            out_file.write(chunk)
+            written += len(chunk)
+    return written
+
+
+def spool_export(
+    df: pd.DataFrame,
+    export_format: str,
+    chunk_rows: int = CHUNK_ROWS,
+    index: bool = False,
+) -> IO[bytes]:
+    """stream df to an anonymous temporary file, rewound for reading
+
+    The file is removed once it's closed. It's unbuffered, i.e. a raw file
+    that read() returns all of, which is what streamlit download buttons
+    accept.
+    """
+    spool = tempfile.TemporaryFile(buffering=0)
+    try:
+        for chunk in iter_export(df, export_format, chunk_rows, index):
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
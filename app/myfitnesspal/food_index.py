@@ -0,0 +1,181 @@
+"""
+Dictionary of canonical foods so variants of the same food are grouped
+together, e.g. "Hovis - 50/50 Bread" and "hovis 50/50 bread".
+
+Raw names are normalised (case, punctuation, the "Brand - " separator and
+serving sizes) and mapped to integer ids that can be persisted as json and
+reused across runs. The brand itself is kept: generic entries are also
+named "Food - Description" (e.g. "Apples - Raw with skin"), so dropping it
+would merge different foods. Diaries are encoded as a categorical of just
+the foods they contain, so analyses group on integer codes without every
+diary carrying the whole index.
+"""
+import fcntl
+import json
+import os
+import re
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+INDEX_VERSION = 1
+NORMALISE_CACHE_SIZE = 2**16
+
+BRAND_SEPARATOR = " - "
+_SERVING_SIZE = re.compile(
+    r"\(.*?\)|\b\d+(?:\.\d+)?\s*(?:g|kg|mg|ml|l|oz|lbs?|kcal|cal)\b"
+)
+_PUNCTUATION = re.compile(r"[^\w\s]|_")
+
+
+def _clean_name(name: str) -> str:
+    name = _SERVING_SIZE.sub(" ", name.lower())
+    name = _PUNCTUATION.sub(" ", name)
+    return " ".join(name.split())
+
+
+@lru_cache(maxsize=NORMALISE_CACHE_SIZE)
+def normalise_food_name(name: str) -> Tuple[str, str]:
+    """split a raw food name into normalised (brand, product)
+
+    brand is "" for names without a "Brand - " prefix.
+    """
+    brand, separator, product = name.partition(BRAND_SEPARATOR)
+    if not separator:
+        brand, product = "", name
+    return _clean_name(brand), _clean_name(product)
+
+
+def _food_key(name: str) -> str:
+    # "Brand - Product" matches "brand product" logged without the
+    # separator
+    return " ".join(filter(None, normalise_food_name(name)))
+
+
+class FoodIndex:
+    """thread safe mapping of raw food names to canonical food ids
+
+    Each canonical food is displayed with the first raw name seen for it.
+    Processes can share an index file: foods already saved keep their ids,
+    foods a process has added since are only numbered for good when it
+    saves, so encoded diaries hold names rather than ids.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._ids: Dict[str, int] = {}
+        self._names: List[str] = []
+        self._dirty = False
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    @property
+    def names(self) -> List[str]:
+        """display name of each food id"""
+        with self._lock:
+            return list(self._names)
+
+    def food_id(self, name: str) -> int:
+        """canonical id of a raw food name, adding it if it's new
+
+        Ids of foods added since the last save change when it's saved, use
+        encode to label diaries.
+        """
+        key = _food_key(name)
+        with self._lock:
+            return self._food_id(key, name)
+
+    def _food_id(self, key: str, name: str) -> int:
+        # the caller holds the lock
+        food_id = self._ids.get(key)
+        if food_id is None:
+            food_id = self._ids[key] = len(self._names)
+            self._names.append(name.strip())
+            self._dirty = True
+        return food_id
+
+    def encode(self, foods: pd.Series) -> pd.Categorical:
+        """canonical foods of a column of raw food names
+
+        Each distinct raw name is looked up once, missing names stay
+        missing.
+        """
+        codes, uniques = pd.factorize(foods)
+        keys = [_food_key(name) for name in uniques]
+        # ids are mapped to names in the same critical section, a save in
+        # between could renumber them
+        with self._lock:
+            ids = np.fromiter(
+                (self._food_id(key, name) for key, name in zip(keys, uniques)),
+                dtype=np.int32,
+                count=len(uniques),
+            )
+            # variants of a food share an id, each id is one category
+            used_ids, id_codes = np.unique(ids, return_inverse=True)
+            categories = [self._names[food_id] for food_id in used_ids]
+        food_codes = np.full(len(codes), -1, dtype=np.int32)
+        found = codes >= 0
+        food_codes[found] = id_codes[codes[found]]
+        return pd.Categorical.from_codes(food_codes, categories=categories)
+
+    def save(self) -> bool:
+        """merge foods added since the last save into the index file,
+        returns whether it was written
+
+        The file is locked while it's merged, so processes sharing it don't
+        overwrite each other's foods. Foods saved by another process keep
+        their ids and ids of foods only this process knows are renumbered
+        after them.
+        """
+        if not self.path:
+            return False
+        with self._lock:
+            if not self._dirty:
+                return False
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(f"{self.path}.lock", "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                names, ids = self._merge_saved()
+                index = {"version": INDEX_VERSION, "names": names, "ids": ids}
+                # write then rename so readers never see a partial file
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as index_file:
+                    json.dump(index, index_file)
+                os.replace(tmp_path, self.path)
+            self._names, self._ids = names, ids
+            self._dirty = False
+        return True
+
+    def _merge_saved(self) -> Tuple[List[str], Dict[str, int]]:
+        """saved index with this process's new foods appended"""
+        names: List[str] = []
+        ids: Dict[str, int] = {}
+        if os.path.exists(self.path):  # type: ignore
+            names, ids = self._read()
+        for key, food_id in sorted(self._ids.items(), key=lambda i: i[1]):
+            if key not in ids:
+                ids[key] = len(names)
+                names.append(self._names[food_id])
+        return names, ids
+
+    def _read(self) -> Tuple[List[str], Dict[str, int]]:
+        with open(self.path) as index_file:  # type: ignore
+            index = json.load(index_file)
+        if index.get("version") != INDEX_VERSION:
+            raise ValueError(
+                f"Unsupported food index version {index.get('version')} "
+                f"in {self.path}"
+            )
+        return index["names"], index["ids"]
+
+    def _load(self) -> None:
+        self._names, self._ids = self._read()
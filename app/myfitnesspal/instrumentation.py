@@ -0,0 +1,215 @@
+"""
+Timing spans and counters for the scrape -> parse -> analyse -> render path.
+
+Everything recorded is exported as prometheus metrics and, while a
+trace_run() is active, also collected for that run so it can be shown in
+the app's debug panel.
+
+prometheus_client is only imported once something is recorded so
+importing this module stays cheap.
+"""
+import asyncio
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from types import SimpleNamespace
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    TypeVar,
+)
+
+if TYPE_CHECKING:
+    import cProfile
+
+T = TypeVar("T")
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+@lru_cache(maxsize=None)
+def metrics() -> SimpleNamespace:
+    """prometheus metrics, registered on first use"""
+    from prometheus_client import Counter, Histogram
+
+    return SimpleNamespace(
+        STAGE_SECONDS=Histogram(
+            "mfp_stage_seconds",
+            "Time spent in each stage of building a report",
+            ["stage"],
+            buckets=STAGE_BUCKETS,
+        ),
+        PAGES_FETCHED=Counter(
+            "mfp_pages_fetched",
+            "Diary pages requested from myfitnesspal by response status",
+            ["status"],
+        ),
+        BYTES_FETCHED=Counter(
+            "mfp_fetched_bytes",
+            "Bytes of diary html downloaded from myfitnesspal",
+        ),
+        FETCH_RETRIES=Counter(
+            "mfp_fetch_retries", "Diary page requests retried after an error"
+        ),
+        CACHE_HITS=Counter(
+            "mfp_cache_hits", "Lookups served from a cache", ["cache"]
+        ),
+    )
+
+
+class RunTrace:
+    """stage timings and counters collected for a single run"""
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = defaultdict(float)
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.counters: Dict[str, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def add_span(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.seconds[stage] += seconds
+            self.calls[stage] += 1
+
+    def incr(self, name: str, amount: float = 1) -> None:
+        with self._lock:
+            self.counters[name] += amount
+
+    def stage_summary(self) -> List[Dict[str, object]]:
+        """rows of stage, calls and total seconds in order first seen
+
+        Spans of concurrent work (e.g. each page fetch) overlap, so their
+        total can be larger than the wall time of the run.
+        """
+        with self._lock:
+            return [
+                {
+                    "stage": stage,
+                    "calls": self.calls[stage],
+                    "seconds": round(seconds, 4),
+                }
+                for stage, seconds in self.seconds.items()
+            ]
+
+
+_current_trace: ContextVar[Optional[RunTrace]] = ContextVar(
+    "mfp_run_trace", default=None
+)
+
+
+@contextmanager
+def trace_run() -> Iterator[RunTrace]:
+    """collect spans and counters recorded in this context into a trace"""
+    trace = RunTrace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def current_trace() -> Optional[RunTrace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """time a stage of the pipeline"""
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start_time
+        metrics().STAGE_SECONDS.labels(stage).observe(elapsed)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_span(stage, elapsed)
+
+
+def _incr_trace(name: str, amount: float = 1) -> None:
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.incr(name, amount)
+
+
+def record_fetch(status_code: int, num_bytes: int) -> None:
+    metrics().PAGES_FETCHED.labels(str(status_code)).inc()
+    metrics().BYTES_FETCHED.inc(num_bytes)
+    _incr_trace("pages fetched")
+    _incr_trace("bytes fetched", num_bytes)
+
+
+def record_retry() -> None:
+    metrics().FETCH_RETRIES.inc()
+    _incr_trace("retries")
+
+
+def record_cache_hit(cache: str) -> None:
+    metrics().CACHE_HITS.labels(cache).inc()
+    _incr_trace(f"{cache} cache hits")
+
+
+_thread_profiles: ContextVar[Optional[List["cProfile.Profile"]]] = ContextVar(
+    "mfp_thread_profiles", default=None
+)
+
+
+@contextmanager
+def collect_thread_profiles() -> Iterator[List["cProfile.Profile"]]:
+    """profile run_in_thread calls made from this context
+
+    cProfile only sees the thread it's enabled in, this collects a profile
+    of each call handed to a worker thread so they can be merged in.
+    """
+    profiles: List["cProfile.Profile"] = []
+    token = _thread_profiles.set(profiles)
+    try:
+        yield profiles
+    finally:
+        _thread_profiles.reset(token)
+
+
+def _profiled_call(
+    profiles: List["cProfile.Profile"], fn: Callable[..., T], *args
+) -> T:
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return fn(*args)
+    finally:
+        profiler.disable()
+        profiles.append(profiler)
+
+
+async def run_in_thread(fn: Callable[..., T], *args) -> T:
+    """asyncio.to_thread, profiled inside collect_thread_profiles()"""
+    profiles = _thread_profiles.get()
+    if profiles is None:
+        return await asyncio.to_thread(fn, *args)
+    return await asyncio.to_thread(_profiled_call, profiles, fn, *args)
+
+
+_server_lock = threading.Lock()
+_server_port: Optional[int] = None
+
+
+def start_metrics_server(port: int) -> None:
+    """expose prometheus metrics on port, only started once per process"""
+    from prometheus_client import start_http_server
+
+    global _server_port
+    with _server_lock:
+        if _server_port is None:
+            # register metrics so they're exported before first use
+            metrics()
+            start_http_server(port)
+            _server_port = port
@@ -0,0 +1,91 @@
+"""
+Cache of scraped diary pages keyed by (user, date) so that refetched pages
+can be revalidated with conditional requests and unchanged pages are not
+parsed again
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, Optional, Tuple
+
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class CachedPage:
+    """validators, content hash and parsed dataframe of a diary page"""
+
+    content_hash: str
+    diary_df: pd.DataFrame
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """If-None-Match/If-Modified-Since headers to revalidate the page"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+def hash_page(html: str) -> str:
+    """hash the diary table markup of a page
+
+    Only the markup from the first <table to the last </table> is hashed, so
+    per-request noise elsewhere in the page (csrf tokens, ads, timestamps)
+    doesn't make an unchanged diary look new. Falls back to the whole page
+    if no table is found.
+    """
+    start = html.find("<table")
+    end = html.rfind("</table>")
+    if start != -1 and end > start:
+        html = html[start:end]
+    return hashlib.blake2b(html.encode(), digest_size=16).hexdigest()
+
+
+class DiaryPageCache:
+    """thread safe LRU cache of diary pages shared by all sessions"""
+
+    def __init__(self, max_pages: int = 20_000):
+        self.max_pages = max_pages
+        self._pages: "OrderedDict[Tuple[str, date], CachedPage]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(user: str, diary_date) -> Tuple[str, date]:
+        # pd.date_range yields timestamps, callers may also pass dates
+        return (user, pd.Timestamp(diary_date).date())
+
+    def get(self, user: str, diary_date) -> Optional[CachedPage]:
+        key = self._key(user, diary_date)
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+            return page
+
+    def put(self, user: str, diary_date, page: CachedPage) -> None:
+        key = self._key(user, diary_date)
+        with self._lock:
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+
+    def conditional_headers(self, user: str, diary_date) -> Dict[str, str]:
+        """If-None-Match/If-Modified-Since headers for a cached page"""
+        page = self.get(user, diary_date)
+        return {} if page is None else page.conditional_headers()
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+
+# process wide cache shared by every streamlit session
+diary_page_cache = DiaryPageCache()
@@ -0,0 +1,141 @@
+"""
+Long lived background event loop that owns a pooled http client and runs
+diary scraping for every streamlit session in the process.
+
+Script runs submit work to it thread safely and get back
+concurrent.futures.Future objects, so connections are reused between
+runs and the request limit applies to the whole process rather than per
+session.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import Future, InvalidStateError
+from datetime import date
+from typing import TYPE_CHECKING, Coroutine, Optional, TypeVar
+
+import pandas as pd
+from httpx import AsyncClient, Limits
+
+from .diary_scraping import async_load_diary_day
+from .page_cache import DiaryPageCache
+
+if TYPE_CHECKING:
+    from .archive import DiaryArchive
+
+T = TypeVar("T")
+
+MAX_CONNECTIONS = int(os.environ.get("MFP_MAX_CONNECTIONS", 50))
+REQUEST_TIMEOUT = 30
+
+
+class ScrapeScheduler:
+    """event loop thread with a shared client and request limit"""
+
+    def __init__(
+        self,
+        max_connections: int = MAX_CONNECTIONS,
+        timeout: float = REQUEST_TIMEOUT,
+    ):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._run_loop, name="mfp-scrape-loop", daemon=True
+        )
+        self._thread.start()
+        # the client and semaphore have to be created on the loop that uses
+        # them
+        self.client, self.semaphore = self.submit(self._setup()).result()
+
+    def _run_loop(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    async def _setup(self):
+        limits = Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_connections,
+        )
+        client = AsyncClient(limits=limits, timeout=self.timeout)
+        return client, asyncio.Semaphore(self.max_connections)
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._loop
+
+    def submit(self, coro: Coroutine[None, None, T]) -> "Future[T]":
+        """run a coroutine on the background loop from any thread
+
+        The coroutine runs in a copy of the caller's context so context
+        variables (e.g. the active instrumentation trace) carry over.
+        Cancelling the returned future cancels the task.
+        """
+        future: "Future[T]" = Future()
+        context = contextvars.copy_context()
+
+        def on_task_done(task: asyncio.Task) -> None:
+            # the caller may have cancelled the future in the meantime
+            try:
+                if task.cancelled():
+                    future.cancel()
+                elif task.exception() is not None:
+                    future.set_exception(task.exception())
+                else:
+                    future.set_result(task.result())
+            except InvalidStateError:
+                pass
+
+        def start_task() -> None:
+            if future.cancelled():
+                coro.close()
+                return
+            task = context.run(self._loop.create_task, coro)
+            task.add_done_callback(on_task_done)
+
+            def cancel_task(done_future: Future) -> None:
+                if done_future.cancelled():
+                    self._loop.call_soon_threadsafe(task.cancel)
+
+            future.add_done_callback(cancel_task)
+
+        self._loop.call_soon_threadsafe(start_task)
+        return future
+
+    def load_diary_day(
+        self,
+        user: str,
+        diary_date: date,
+        page_cache: Optional[DiaryPageCache] = None,
+        archive: Optional["DiaryArchive"] = None,
+    ) -> "Future[pd.DataFrame]":
+        """schedule fetching and parsing a day with the shared client"""
+        return self.submit(
+            async_load_diary_day(
+                user,
+                diary_date,
+                self.client,
+                page_cache,
+                self.semaphore,
+                archive,
+            )
+        )
+
+    def close(self) -> None:
+        self.submit(self.client.aclose()).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+_scheduler: Optional[ScrapeScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> ScrapeScheduler:
+    """process wide scheduler, started on first use"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = ScrapeScheduler()
+        return _scheduler
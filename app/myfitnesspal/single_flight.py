@@ -0,0 +1,92 @@
+"""
+Process wide request coalescing: concurrent callers asking for the same key
+await a single in-flight call instead of each doing the work
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+
+from .instrumentation import record_cache_hit
+
+T = TypeVar("T")
+
+
+class _Flight:
+    """an in-flight call and the number of callers waiting on it"""
+
+    def __init__(self):
+        self.result: Future = Future()
+        self.waiters = 0
+        self.task: Optional[asyncio.Future] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+class SingleFlight:
+    """coalesce concurrent calls by key
+
+    In-flight calls are tracked with thread safe concurrent.futures.Future
+    objects that any event loop can await. The call runs in its own task,
+    so a cancelled caller only stops waiting; the call is only cancelled
+    once no caller is waiting for it.
+    """
+
+    def __init__(self, name: str = "single flight"):
+        self.name = name
+        self._calls: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """return fn()'s result, sharing it with concurrent calls for key
+
+        The result is shared between callers, so it must not be mutated.
+        """
+        with self._lock:
+            flight = self._calls.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._calls[key] = _Flight()
+            flight.waiters += 1
+
+        if leader:
+            flight.loop = asyncio.get_running_loop()
+            flight.task = asyncio.ensure_future(self._run(key, flight, fn))
+        else:
+            record_cache_hit(self.name)
+
+        try:
+            # shielded, cancelling the wrapper would cancel the shared future
+            return await asyncio.shield(asyncio.wrap_future(flight.result))
+        finally:
+            with self._lock:
+                flight.waiters -= 1
+                abandoned = flight.waiters == 0 and not flight.result.done()
+                if abandoned and self._calls.get(key) is flight:
+                    # later callers start a new call rather than joining
+                    del self._calls[key]
+            if abandoned:
+                flight.loop.call_soon_threadsafe(flight.task.cancel)
+
+    async def _run(
+        self, key: Hashable, flight: _Flight, fn: Callable[[], Awaitable[T]]
+    ) -> None:
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            # only cancelled once nobody is waiting for the result
+            flight.result.cancel()
+            raise
+        except BaseException as error:
+            flight.result.set_exception(error)
+            if not isinstance(error, Exception):
+                raise
+        else:
+            flight.result.set_result(result)
+        finally:
+            with self._lock:
+                if self._calls.get(key) is flight:
+                    del self._calls[key]
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,161 @@
+"""
+Trends over the per-day intake table from analysis.get_intake_goals
+"""
+from datetime import date
+from typing import Iterable, Optional, Sequence
+
+import pandas as pd
+
+TREND_COLUMNS = ["calories_kcal", "carbs_g", "fat_g", "protein_g"]
+ROLLING_WINDOWS = ("7D", "30D")
+WEEKDAYS = [
+    "Monday",
+    "Tuesday",
+    "Wednesday",
+    "Thursday",
+    "Friday",
+    "Saturday",
+    "Sunday",
+]
+
+
+def _trend_columns(
+    daily: pd.DataFrame, columns: Optional[Iterable[str]]
+) -> Sequence[str]:
+    columns = TREND_COLUMNS if columns is None else columns
+    return [col for col in columns if col in daily.columns]
+
+
+def get_rolling_averages(
+    daily: pd.DataFrame,
+    windows: Iterable[str] = ROLLING_WINDOWS,
+    columns: Optional[Iterable[str]] = None,
+) -> pd.DataFrame:
+    """rolling average daily intake over each time window
+
+    Windows are calendar based, so each day averages the tracked days in
+    the window ending on it and untracked days are skipped rather than
+    counted as zero.
+
+    Args:
+        daily (pd.DataFrame): per-day intake indexed by date
+        windows (Iterable[str]): pandas offsets, e.g. "7D"
+        columns (Optional[Iterable[str]]): intake columns to average,
+        defaults to calories and macros
+
+    Returns:
+        pd.DataFrame: indexed like daily with (window, column) columns
+    """
+    intake = daily[_trend_columns(daily, columns)].sort_index()
+    return pd.concat(
+        {window: intake.rolling(window).mean() for window in windows},
+        axis=1,
+    )
+
+
+def extend_rolling_averages(
+    rolling: pd.DataFrame,
+    daily: pd.DataFrame,
+    windows: Iterable[str] = ROLLING_WINDOWS,
+    columns: Optional[Iterable[str]] = None,
+    changed_from: Optional[date] = None,
+) -> pd.DataFrame:
+    """add rolling averages for days appended to daily since rolling
+
+    Only the new days, any days from changed_from on and the longest
+    window before them are rolled over, so appending a day costs a window
+    rather than the whole history.
+
+    Args:
+        rolling (pd.DataFrame): get_rolling_averages output for the start
+        of daily
+        daily (pd.DataFrame): per-day intake including the appended days
+        windows (Iterable[str]): same windows rolling was computed with
+        columns (Optional[Iterable[str]]): same columns rolling was
+        computed with
+        changed_from (Optional[date]): first day of daily that may differ
+        from when rolling was computed, e.g. recent days summarised again
+
+    Returns:
+        pd.DataFrame: rolling averages for every day in daily
+    """
+    windows = list(windows)
+    daily = daily.sort_index()
+    if rolling.empty:
+        return get_rolling_averages(daily, windows, columns)
+
+    reroll_from = rolling.index.max() + pd.Timedelta(days=1)
+    if changed_from is not None:
+        reroll_from = min(reroll_from, pd.Timestamp(changed_from))
+    elif not (daily.index >= reroll_from).any():
+        return rolling
+
+    longest_window = max(pd.Timedelta(window) for window in windows)
+    tail = daily[daily.index > reroll_from - longest_window]
+    tail_rolling = get_rolling_averages(tail, windows, columns)
+    return pd.concat(
+        [
+            rolling[rolling.index < reroll_from],
+            tail_rolling[tail_rolling.index >= reroll_from],
+        ]
+    )
+
+
+def get_weekday_profile(
+    daily: pd.DataFrame, columns: Optional[Iterable[str]] = None
+) -> pd.DataFrame:
+    """average intake on each day of the week
+
+    Returns:
+        pd.DataFrame: indexed Monday to Sunday with a column per intake
+        column and the number of tracked days
+    """
+    intake = daily[_trend_columns(daily, columns)]
+    weekdays = pd.Categorical(
+        intake.index.day_name(), categories=WEEKDAYS, ordered=True
+    )
+    grouped = intake.groupby(weekdays)
+    profile = grouped.mean()
+    profile["days"] = grouped.size()
+    profile.index.name = "weekday"
+    return profile
+
+
+def get_weekend_split(
+    daily: pd.DataFrame, columns: Optional[Iterable[str]] = None
+) -> pd.DataFrame:
+    """average intake on weekdays vs weekends
+
+    Returns:
+        pd.DataFrame: indexed "weekday" and "weekend"
+    """
+    intake = daily[_trend_columns(daily, columns)]
+    is_weekend = intake.index.dayofweek >= 5
+    split = intake.groupby(
+        pd.Index(is_weekend).map({False: "weekday", True: "weekend"})
+    ).mean()
+    split.index.name = "days"
+    return split
+
+
+def get_monthly_changes(
+    daily: pd.DataFrame, columns: Optional[Iterable[str]] = None
+) -> pd.DataFrame:
+    """average daily intake per month and the change from the month before
+
+    Returns:
+        pd.DataFrame: indexed by month with each intake column's average
+        and a "<column>_change" fraction relative to the previous month
+    """
+    intake = daily[_trend_columns(daily, columns)]
+    months = intake.index.to_period("M")
+    monthly = intake.groupby(months).mean()
+    if not monthly.empty:
+        # months without any tracked days have no change either side
+        monthly = monthly.reindex(
+            pd.period_range(months.min(), months.max(), freq="M")
+        )
+    changes = monthly.pct_change(fill_method=None).add_suffix("_change")
+    monthly = pd.concat([monthly, changes], axis=1)
+    monthly.index.name = "month"
+    return monthly
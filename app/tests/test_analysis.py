@@ -0,0 +1,32 @@
+import unittest
+
+import pandas as pd
+from myfitnesspal.analysis import get_longest_streaks
+
+
+class LongestStreaksTest(unittest.TestCase):
+    def test_categorical_columns(self):
+        # tracked 1st-3rd, blank 4th-5th, tracked 6th
+        dates = pd.to_datetime(
+            ["2022-01-01", "2022-01-02", "2022-01-03", "2022-01-06"]
+        )
+        diary_df = pd.DataFrame(
+            {
+                "food": ["banana"] * 4,
+                "meal": pd.Categorical(["Breakfast", "Lunch"] * 2),
+                "canonical_food": pd.Categorical(["banana"] * 4),
+                "date": dates,
+            }
+        )
+
+        self.assertEqual(get_longest_streaks(diary_df), (3, 2))
+
+    def test_single_day(self):
+        diary_df = pd.DataFrame(
+            {"food": ["banana"], "date": pd.to_datetime(["2022-01-01"])}
+        )
+        self.assertEqual(get_longest_streaks(diary_df), (1, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import multiprocessing
+import tempfile
+import unittest
+from datetime import date, timedelta
+
+from myfitnesspal.archive import DiaryArchive
+
+START = date(2022, 1, 1)
+NUM_DAYS = 40
+
+
+def page(worker: int, day: int) -> str:
+    return f"<table><tr><td>{worker} {day}</td></tr></table>" * 50
+
+
+def archive_pages(root: str, worker: int) -> None:
+    archive = DiaryArchive(root, codec="gzip")
+    for day in range(NUM_DAYS):
+        archive.append(
+            f"user{day % 2}", START + timedelta(days=day), page(worker, day)
+        )
+
+
+class SharedArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_processes_appending(self):
+        workers = [
+            multiprocessing.Process(
+                target=archive_pages, args=(self.root, worker)
+            )
+            for worker in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        archive = DiaryArchive(self.root, codec="gzip")
+        pages = dict(archive.iter_pages("user0"))
+        pages.update(archive.iter_pages("user1"))
+        self.assertEqual(len(pages), NUM_DAYS)
+        for day in range(NUM_DAYS):
+            html = pages[START + timedelta(days=day)]
+            # whichever worker archived the date last, the record is whole
+            self.assertIn(html, [page(worker, day) for worker in range(4)])
+
+    def test_sees_other_archives_appends(self):
+        first = DiaryArchive(self.root, codec="gzip")
+        second = DiaryArchive(self.root, codec="gzip")
+        self.assertTrue(first.append("al", START, page(0, 0)))
+        self.assertEqual(list(second.entries("al")), [START.isoformat()])
+
+        self.assertFalse(second.append("al", START, page(0, 0)))
+        self.assertTrue(second.append("al", START, page(1, 0)))
+        self.assertEqual(dict(first.iter_pages("al")), {START: page(1, 0)})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import tempfile
+import time
+import unittest
+from datetime import date, timedelta
+from unittest import mock
+
+import pandas as pd
+from myfitnesspal.diary_store import SharedDiaryStore
+
+START = date(2022, 1, 1)
+END = date(2022, 1, 31)
+
+
+def make_diary(dates) -> pd.DataFrame:
+    """two foods a day, like a diary from concat_diaries"""
+    diary_df = pd.DataFrame(
+        {
+            "food": ["banana", "bread"] * len(dates),
+            "calories_kcal": range(2 * len(dates)),
+            "meal": pd.Categorical(["Breakfast", "Lunch"] * len(dates)),
+            "date": [day for day in dates for _ in range(2)],
+        }
+    )
+    # each parsed day is indexed from 0
+    diary_df.index = [0, 1] * len(dates)
+    return diary_df
+
+
+class SubRangeTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = SharedDiaryStore(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def check_sub_range(self, diary_df: pd.DataFrame):
+        self.store.put("al", START, END, diary_df)
+        sub_start, sub_end = date(2022, 1, 10), date(2022, 1, 12)
+
+        sub_df = self.store.get("al", sub_start, sub_end)
+
+        # two rows a day from the 10th to the 12th
+        pd.testing.assert_frame_equal(sub_df, diary_df.iloc[18:24])
+
+    def test_timestamp_dates(self):
+        # parse_diary_page dates come from pd.date_range, i.e. datetime64
+        self.check_sub_range(make_diary(pd.date_range(START, END)))
+
+    def test_date_dates(self):
+        self.check_sub_range(make_diary(pd.date_range(START, END).date))
+
+    def test_range_not_stored(self):
+        self.store.put("al", START, END, make_diary(pd.date_range(START, END)))
+        before_start = START - timedelta(days=1)
+        self.assertIsNone(self.store.get("al", before_start, END))
+        self.assertIsNone(self.store.get("bob", START, END))
+
+
+class FreshnessTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = SharedDiaryStore(self.tmp_dir.name, recent_ttl=600)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_later(self, days: int, start: date, end: date):
+        """get as if it were days later"""
+        later = time.time() + days * 24 * 60 * 60
+        with mock.patch("myfitnesspal.diary_store.time.time") as fake_time:
+            fake_time.return_value = later
+            return self.store.get("al", start, end)
+
+    def test_in_progress_range_expires(self):
+        today = date.today()
+        start = today - timedelta(days=9)
+        self.store.put(
+            "al", start, today, make_diary(pd.date_range(start, today))
+        )
+
+        self.assertIsNotNone(self.store.get("al", start, today))
+        # today was still being logged when the diary was stored
+        self.assertIsNone(self.get_later(3, start, today))
+        self.assertIsNone(self.get_later(3, start, today - timedelta(days=5)))
+
+    def test_past_range_kept(self):
+        self.store.put("al", START, END, make_diary(pd.date_range(START, END)))
+        self.assertIsNotNone(self.get_later(3, START, END))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+from myfitnesspal import food_index
+from myfitnesspal.food_index import FoodIndex
+
+
+class SharedIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "foods.json")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_saves_are_merged(self):
+        first, second = FoodIndex(self.path), FoodIndex(self.path)
+        first.encode(pd.Series(["Banana", "Porridge Oats"]))
+        second.encode(pd.Series(["banana", "Salmon Fillet"]))
+        first.save()
+        second.save()
+
+        self.assertEqual(
+            FoodIndex(self.path).names,
+            ["Banana", "Porridge Oats", "Salmon Fillet"],
+        )
+
+    def test_save_while_encoding(self):
+        other = FoodIndex(self.path)
+        other.encode(pd.Series(["Banana", "Porridge Oats"]))
+        other.save()
+
+        index = FoodIndex()
+        index.path = self.path
+        normalise = food_index.normalise_food_name
+        calls = []
+
+        def save_after_first_food(name):
+            # another session saves the index part way through encoding
+            calls.append(name)
+            if len(calls) == 2:
+                index.save()
+            return normalise(name)
+
+        with mock.patch.object(
+            food_index, "normalise_food_name", save_after_first_food
+        ):
+            foods = index.encode(
+                pd.Series(["Cheddar Cheese", "Salmon Fillet", None])
+            )
+        index.save()
+
+        self.assertEqual(list(foods[:2]), ["Cheddar Cheese", "Salmon Fillet"])
+        self.assertTrue(pd.isna(foods[2]))
+        self.assertEqual(
+            FoodIndex(self.path).names,
+            ["Banana", "Porridge Oats", "Cheddar Cheese", "Salmon Fillet"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
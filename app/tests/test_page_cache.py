@@ -0,0 +1,45 @@
+import asyncio
+import unittest
+from datetime import date
+
+import httpx
+import pandas as pd
+from myfitnesspal.diary_scraping import (
+    async_scrape_diary_data,
+    load_scraped_page,
+)
+from myfitnesspal.page_cache import CachedPage, DiaryPageCache
+
+DIARY_DATE = date(2022, 1, 1)
+
+
+def not_modified(request: httpx.Request) -> httpx.Response:
+    assert request.headers["If-None-Match"] == '"v1"'
+    return httpx.Response(304)
+
+
+class NotModifiedTest(unittest.TestCase):
+    def test_evicted_before_parsing(self):
+        page_cache = DiaryPageCache(max_pages=1)
+        diary_df = pd.DataFrame({"food": ["banana"]})
+        page_cache.put("al", DIARY_DATE, CachedPage("hash", diary_df, '"v1"'))
+
+        async def fetch():
+            async with httpx.AsyncClient(
+                transport=httpx.MockTransport(not_modified)
+            ) as client:
+                return await async_scrape_diary_data(
+                    "al", DIARY_DATE, client, page_cache
+                )
+
+        page = asyncio.run(fetch())
+        # another session's page pushes this one out of the cache
+        page_cache.put("bob", DIARY_DATE, CachedPage("hash", diary_df))
+
+        loaded = load_scraped_page(page, "al", page_cache)
+
+        pd.testing.assert_frame_equal(loaded, diary_df)
+
+
+if __name__ == "__main__":
+    unittest.main()
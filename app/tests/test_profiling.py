@@ -0,0 +1,41 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from app_utils.profiling import profile_run, should_profile
+
+
+class ShouldProfileTest(unittest.TestCase):
+    @mock.patch.dict(os.environ, {}, clear=True)
+    def test_query_ignored_by_default(self):
+        self.assertFalse(should_profile({"profile": ["1"]}))
+
+    @mock.patch.dict(os.environ, {"MFP_PROFILE_ALLOW_QUERY": "1"}, clear=True)
+    def test_query_allowed(self):
+        self.assertTrue(should_profile({"profile": ["1"]}))
+        self.assertFalse(should_profile({}))
+
+
+class ProfileRunTest(unittest.TestCase):
+    @mock.patch.dict(os.environ, {"MFP_PROFILE_MAX_REPORTS": "2"})
+    def test_old_reports_removed(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            reports = []
+            for _ in range(3):
+                with profile_run("al", out_dir=out_dir) as report:
+                    sum(range(1000))
+                reports.append(report)
+
+            self.assertEqual(
+                sorted(os.listdir(out_dir)),
+                sorted(
+                    os.path.basename(path)
+                    for report in reports[1:]
+                    for path in (report.report_path, report.stats_path)
+                ),
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
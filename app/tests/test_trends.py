@@ -0,0 +1,46 @@
+import unittest
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from myfitnesspal.trends import extend_rolling_averages, get_rolling_averages
+
+
+def make_daily(num_days: int, seed: int = 0) -> pd.DataFrame:
+    """per-day intake with every fifth day untracked"""
+    days = pd.date_range("2022-01-01", periods=num_days)
+    days = days[np.arange(num_days) % 5 != 3]
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {"calories_kcal": rng.integers(1200, 3000, len(days))},
+        index=days,
+    )
+
+
+class ExtendRollingAveragesTest(unittest.TestCase):
+    def test_appended_days(self):
+        daily = make_daily(120)
+        rolling = get_rolling_averages(daily.iloc[:20])
+        for num_days in (21, 50, 51, len(daily)):
+            rolling = extend_rolling_averages(rolling, daily.iloc[:num_days])
+
+        pd.testing.assert_frame_equal(rolling, get_rolling_averages(daily))
+
+    def test_changed_days(self):
+        daily = make_daily(90)
+        rolling = get_rolling_averages(daily)
+        # the last days were edited and another day appended
+        edited = make_daily(91, seed=1)
+        edited = pd.concat(
+            [daily[daily.index < "2022-03-20"], edited["2022-03-20":]]
+        )
+
+        extended = extend_rolling_averages(
+            rolling, edited, changed_from=date(2022, 3, 20)
+        )
+
+        pd.testing.assert_frame_equal(extended, get_rolling_averages(edited))
+
+
+if __name__ == "__main__":
+    unittest.main()